@@ -31,6 +31,11 @@ Create a workflow and run::
 
     pyp.run(workflow)
 
+For interactive analysis, :py:meth:`pypeliner.app.Pypeline.watch` runs the
+workflow and then reruns the affected jobs whenever its input files change::
+
+    pyp.watch(workflow)
+
 The following options are supported via the config dictionary argument to
 :py:class:`pypeliner.app.Pypeline` or as command line arguments
 by calling :py:func:`pypeliner.app.add_arguments` on an
@@ -85,18 +90,72 @@ by calling :py:func:`pypeliner.app.add_arguments` on an
 
     context_config
         Run jobs within a specific type of container, either docker or singularity.
-        config contains credentials for docker or path to dir with singularity containers
+        config contains credentials for docker or path to dir with singularity containers.
+        The `throttle` section gives limits of named throttles, such that jobs with
+        `ctx={'throttle': {name: amount}}` are only submitted while the total amount
+        used by running jobs is within the limit.
+
+    keep_going
+        After a job fails, continue submitting jobs that are not downstream of the
+        failed job, rather than waiting for running jobs and stopping.  The pipeline
+        still fails once all other jobs are finished.
+
+    max_temp_bytes
+        Budget for the total size of temporary files created by the pipeline.  While
+        the temporary files created and not yet cleaned up exceed the budget, jobs
+        creating temporary files without consuming any are held back, so that jobs
+        consuming temporary files run first and free space.
+        Only supported for local storage.
+
+    createtime_threads
+        Number of threads used to retrieve the creation times of files when the
+        pipeline starts and when axes are split.  Each retrieval is a request to
+        storage backends such as azure blob storage.
+
+    targets
+        Output filenames or job name globs.  Only these jobs, the jobs creating these
+        outputs, and the jobs upstream of them are run.
+
+    schedule
+        Order in which ready jobs are submitted.  With `breadth_first`, jobs are
+        submitted in the order they become ready.  With `depth_first`, jobs downstream
+        of recently completed jobs are preferred, finishing each chunk of an axis
+        before starting new chunks so that temporaries can be cleaned up earlier.
+        With `critical_path`, jobs with the longest chain of downstream jobs are
+        submitted first, weighting each job by its mean duration in previous runs.
+        Regardless of schedule, jobs with a higher `priority` in their context, set
+        when the job is defined or through context_config, are submitted first.
+
+    fair_share
+        Name of an axis, such as a sample axis, across the chunks of which ready jobs
+        are shared.  Jobs on the chunk with the fewest running jobs are submitted
+        first, so that one chunk does not take all parallel jobs while the others
+        wait.  Jobs are also taken from subworkflows in turn.
+
+    flatten_subworkflows
+        Track the jobs of all subworkflows in the dependency graph of the top level
+        workflow, rather than in a separate graph per subworkflow.  Recommended for
+        workflows with many subworkflows.
+
+    plan
+        Do not run any jobs.  Instead write, as json, the jobs that would be run, why
+        they would be run and their context, with the cpu hours and wall time estimated
+        from the durations of jobs in previous runs, to the given file, or to stdout
+        for `-`.  Nothing is written to the pipeline directory, and logs are only
+        written to the console.
 
 """
 
 import argparse
 import datetime
+import json
 import logging
 import os
 from collections import *
 
 import pypeliner.execqueue
 import pypeliner.execqueue.factory
+import pypeliner.graph
 import pypeliner.helpers
 import pypeliner.runskip
 import pypeliner.scheduler
@@ -129,6 +188,14 @@ config_infos.append(ConfigInfo('nocleanup', bool, False, 'do not automatically c
 config_infos.append(ConfigInfo('interactive', bool, False, 'run in interactive mode'))
 config_infos.append(ConfigInfo('sentinel_only', bool, False, 'no timestamp checks, sentinal only'))
 config_infos.append(ConfigInfo('context_config', str, None, 'container registry credentials and job context overrides'))
+config_infos.append(ConfigInfo('schedule', pypeliner.graph.schedules, pypeliner.graph.schedules[0], 'order in which ready jobs are submitted'))
+config_infos.append(ConfigInfo('fair_share', str, None, 'share parallel jobs across the chunks of this axis'))
+config_infos.append(ConfigInfo('flatten_subworkflows', bool, False, 'track subworkflow jobs in a single dependency graph'))
+config_infos.append(ConfigInfo('keep_going', bool, False, 'continue running jobs independent of failed jobs'))
+config_infos.append(ConfigInfo('max_temp_bytes', int, None, 'hold back jobs creating temporaries beyond this size'))
+config_infos.append(ConfigInfo('createtime_threads', int, pypeliner.storage.default_createtime_threads, 'threads retrieving file creation times'))
+config_infos.append(ConfigInfo('plan', str, None, 'write the jobs that would run and their estimated cost as json, - for stdout'))
+config_infos.append(ConfigInfo('targets', list, None, 'only run jobs required for these output filenames or job name globs'))
 
 config_defaults = dict([(info.name, info.default) for info in config_infos])
 
@@ -143,6 +210,8 @@ def _add_argument(argparser, config_info):
     elif config_info.type == bool:
         kwargs['action'] = 'store_true'
         kwargs['default'] = False
+    elif config_info.type == list:
+        kwargs['nargs'] = '+'
     else:
         kwargs['type'] = config_info.type
     kwargs['help'] = config_info.help
@@ -205,10 +274,15 @@ class Pypeline(object):
         datetime_log_prefix = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
         self.logs_dir = os.path.join(self.config['pipelinedir'], 'log', datetime_log_prefix)
         self.pipeline_log_filename = os.path.join(self.logs_dir, 'pipeline.log')
-        pypeliner.helpers.makedirs(self.logs_dir)
-        pypeliner.helpers.symlink(self.logs_dir, os.path.join(self.config['pipelinedir'], 'log', 'latest'))
 
-        logging.basicConfig(level=logging.DEBUG, filename=self.pipeline_log_filename, filemode='a')
+        # Plans only log to the console, leaving the pipeline directory untouched
+        is_plan = self.config['plan'] is not None
+        if not is_plan:
+            pypeliner.helpers.makedirs(self.logs_dir)
+            pypeliner.helpers.symlink(self.logs_dir, os.path.join(self.config['pipelinedir'], 'log', 'latest'))
+            logging.basicConfig(level=logging.DEBUG, filename=self.pipeline_log_filename, filemode='a')
+        else:
+            logging.getLogger('').setLevel(logging.DEBUG)
         console = logging.StreamHandler()
         console.setLevel(self.config['loglevel'])
         logging.getLogger('').addHandler(console)
@@ -217,13 +291,14 @@ class Pypeline(object):
             handler.setFormatter(logfmt)
 
         # add json log file to the log_dir
-        json_log_file = os.path.join(self.logs_dir, 'pipeline.json')
-        jsonlog = logging.FileHandler(json_log_file, mode='a')
-        jsonlog.setLevel(self.config['loglevel'])
-        jsonlog.addFilter(logging.Filter('pypeliner'))
-        logfmt = pypeliner.helpers.JsonFormatter()
-        jsonlog.setFormatter(logfmt)
-        logging.getLogger('').addHandler(jsonlog)
+        if not is_plan:
+            json_log_file = os.path.join(self.logs_dir, 'pipeline.json')
+            jsonlog = logging.FileHandler(json_log_file, mode='a')
+            jsonlog.setLevel(self.config['loglevel'])
+            jsonlog.addFilter(logging.Filter('pypeliner'))
+            logfmt = pypeliner.helpers.JsonFormatter()
+            jsonlog.setFormatter(logfmt)
+            logging.getLogger('').addHandler(jsonlog)
 
         self.exec_queue = pypeliner.execqueue.factory.create(
             self.config['submit'], modules=self.modules,
@@ -231,7 +306,7 @@ class Pypeline(object):
             config_filename=self.config['submit_config'])
 
         self.file_storage = pypeliner.storage.create(
-            self.config['storage'], workflow_dir=self.config['pipelinedir'])
+            self.config['storage'], workflow_dir=self.config['pipelinedir'], in_memory=is_plan)
 
         self.sch = pypeliner.scheduler.Scheduler()
 
@@ -240,9 +315,15 @@ class Pypeline(object):
         self.sch.logs_dir = self.logs_dir
         self.sch.max_jobs = int(self.config['maxjobs'])
         self.sch.cleanup = not self.config['nocleanup']
+        self.sch.flatten_subworkflows = self.config['flatten_subworkflows']
+        self.sch.schedule = self.config['schedule']
+        self.sch.fair_share = self.config['fair_share']
+        self.sch.keep_going = self.config['keep_going']
+        self.sch.max_temp_bytes = self.config['max_temp_bytes']
         pypeliner.helpers.GlobalState.set('context_config', load_config(self.config['context_config']))
         pypeliner.helpers.GlobalState.set('sentinel_only', self.config['sentinel_only'])
         pypeliner.helpers.GlobalState.set('tmpdir', self.config['tmpdir'])
+        pypeliner.helpers.GlobalState.set('createtime_threads', self.config['createtime_threads'])
 
         if self.config['sentinel_only']:
             self.runskip = pypeliner.runskip.SentinalRunSkip(
@@ -255,10 +336,64 @@ class Pypeline(object):
         if self.config['interactive']:
             self.runskip = pypeliner.runskip.InteractiveRunSkip(self.runskip)
 
-    def run(self, workflow):
+    def run(self, workflow, targets=None):
+        """ Run a workflow
+
+        :param workflow: workflow to run.
+        :param targets: output filenames or job name globs.  If given, only the jobs
+                        required for these outputs or jobs are run.  Defaults to the
+                        `targets` option.
+
+        """
+        if self.config['plan'] is not None:
+            return self.plan(workflow, self.config['plan'], targets=targets)
+        if targets is None:
+            targets = self.config['targets']
+        with self.exec_queue, self.file_storage:
+            try:
+                self.sch.run(workflow, self.exec_queue, self.file_storage, self.runskip, targets=targets)
+            finally:
+                self.runskip.close()
+                print ('log file: ' + self.pipeline_log_filename)
+
+    def plan(self, workflow, plan_filename, targets=None):
+        """ Write the jobs a run of the workflow would run as json, without
+        running any jobs.  See :py:meth:`pypeliner.scheduler.Scheduler.plan`.
+
+        :param workflow: workflow to plan.
+        :param plan_filename: file to write the plan to, or `-` for stdout.
+        :param targets: output filenames or job name globs, as for :py:meth:`run`.
+
+        """
+        if targets is None:
+            targets = self.config['targets']
+        with self.file_storage:
+            try:
+                plan = self.sch.plan(workflow, self.file_storage, self.runskip, targets=targets)
+            finally:
+                self.runskip.close()
+        plan_json = json.dumps(plan, indent=2, sort_keys=True, default=str)
+        if plan_filename == '-':
+            print (plan_json)
+        else:
+            with open(plan_filename, 'w') as plan_file:
+                plan_file.write(plan_json + '\n')
+        return plan
+
+    def watch(self, workflow, targets=None):
+        """ Run a workflow, then rerun the jobs affected by changes to its input
+        files until interrupted.  The dependency graph and cached file creation
+        times are kept in memory between runs.
+
+        :param workflow: workflow to run.
+        :param targets: output filenames or job name globs, as for :py:meth:`run`.
+
+        """
+        if targets is None:
+            targets = self.config['targets']
         with self.exec_queue, self.file_storage:
             try:
-                self.sch.run(workflow, self.exec_queue, self.file_storage, self.runskip)
+                self.sch.watch(workflow, self.exec_queue, self.file_storage, self.runskip, targets=targets)
             finally:
                 self.runskip.close()
                 print ('log file: ' + self.pipeline_log_filename)
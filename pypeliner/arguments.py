@@ -1,5 +1,8 @@
+import base64
 import os
 
+import dill as pickle
+
 import pypeliner.helpers
 import pypeliner.identifiers
 import pypeliner.resources
@@ -7,6 +10,7 @@ import pypeliner.resources
 
 class Arg(object):
     is_split = False
+    is_streaming = False
 
     def get_inputs(self):
         return []
@@ -20,6 +24,11 @@ class Arg(object):
     def get_split_outputs(self):
         return []
 
+    def get_split_axes(self):
+        if not self.is_split:
+            return []
+        return [self.axes[level] for level in sorted(self.axes_origin)]
+
     def resolve(self):
         return None
 
@@ -29,6 +38,9 @@ class Arg(object):
     def finalize(self, v):
         pass
 
+    def receive_commits(self, job):
+        return [], []
+
     def allocate(self):
         pass
 
@@ -51,6 +63,13 @@ class SplitMergeArg(object):
             return set(range(len(self.axes)))
         return axes_origin
 
+    def get_is_streaming(self, streaming):
+        if not streaming or not self.is_split:
+            return False
+        if len(self.axes) != 1:
+            raise ValueError('streaming split of {} must be on a single axis'.format(self.name))
+        return True
+
 
 class TemplateArg(Arg):
     """ Templated name argument
@@ -276,8 +295,10 @@ class SplitFileArg(Arg, SplitMergeArg):
         self.merge_inputs = list(db.nodemgr.get_merge_inputs(self.axes, self.node, subset=self.axes_origin))
         filename_creator = db.get_user_filename_creator(
             self.name, self.node.axes + self.axes, fnames=self.fnames, template=self.template)
+        self.is_streaming = self.get_is_streaming(kwargs.get('streaming'))
         self.filename_callback = UserFilenameCallback(
-            db.file_storage, self.name, self.node, self.axes, filename_creator, **kwargs)
+            db.file_storage, self.name, self.node, self.axes, filename_creator,
+            is_streaming=self.is_streaming, **kwargs)
 
     def get_merge_inputs(self):
         return self.merge_inputs
@@ -295,9 +316,19 @@ class SplitFileArg(Arg, SplitMergeArg):
         if self.is_split:
             job.workflow.db.nodemgr.store_chunks(self.axes, self.node, list(self.filename_callback.resources.keys()), subset=self.axes_origin)
 
+    def receive_commits(self, job):
+        chunks = self.filename_callback.receive_commits()
+        if len(chunks) == 0:
+            return [], []
+        job.workflow.db.nodemgr.store_chunks(
+            self.axes, self.node, list(self.filename_callback.received), subset=self.axes_origin, persist=False)
+        nodes = [self.node + pypeliner.identifiers.AxisInstance(self.axes[0], chunk) for chunk in chunks]
+        created = [(self.name, node) for node in nodes]
+        partial = [(output.id, node) for output in self.split_outputs for node in nodes]
+        return created, partial
+
     def push(self):
-        for resource in self.filename_callback.resources.values():
-            resource.push()
+        self.filename_callback.push()
 
 
 class TempInputObjArg(Arg):
@@ -538,9 +569,16 @@ class TempOutputFileArg(Arg):
 
 class FilenameCallback(object):
     """ Argument to split jobs providing callback for filenames
-    with a particular instance """
+    with a particular instance
+
+    For a streaming split, the files of each chunk can be committed before
+    the job completes, allowing jobs on that chunk to start.  Commits are
+    recorded in a file in the job's store directory that is read by the
+    scheduler while the job is running.
+
+    """
 
-    def __init__(self, storage, name, node, axes, filename_creator, **kwargs):
+    def __init__(self, storage, name, node, axes, filename_creator, is_streaming=False, **kwargs):
         self.storage = storage
         self.name = name
         self.node = node
@@ -548,6 +586,18 @@ class FilenameCallback(object):
         self.filename_creator = filename_creator
         self.resources = dict()
         self.kwargs = kwargs
+        self.commits_filename = None
+        if is_streaming and kwargs.get('store_dir') is not None:
+            commits_name = '{}.commits'.format(name.replace(os.sep, '_'))
+            self.commits_filename = os.path.join(kwargs['store_dir'], commits_name)
+        self.committed = set()
+        self.received = set()
+        self.commits_offset = 0
+
+    def _get_key(self, chunks):
+        if len(chunks) == 1:
+            return chunks[0]
+        return chunks
 
     def get_filename(self, *chunks):
         if len(self.axes) != len(chunks):
@@ -578,13 +628,52 @@ class FilenameCallback(object):
             direct_write=self.kwargs.get('direct_write'),
             store_dir=self.kwargs.get('store_dir'),
             extensions=self.kwargs.get('extensions'))
-        if len(chunks) == 1:
-            self.resources[chunks[0]] = resource
-        else:
-            self.resources[chunks] = resource
+        if self._get_key(chunks) in self.committed:
+            raise ValueError('chunk {} of {} already committed'.format(self._get_key(chunks), self.name))
+        self.resources[self._get_key(chunks)] = resource
         resource.allocate()
         return resource.write_filename
 
+    def commit(self, *chunks):
+        """ Commit the file of a chunk, allowing jobs on the chunk to start
+        before the split completes.  The file must not be modified after it is
+        committed.
+        """
+        if self.commits_filename is None:
+            raise ValueError('commit requires a streaming split of ' + self.name)
+        key = self._get_key(chunks)
+        resource = self.resources[key]
+        resource.push()
+        self.committed.add(key)
+        with open(self.commits_filename, 'ab') as commits_file:
+            commits_file.write(base64.b64encode(pickle.dumps((key, resource))) + b'\n')
+
+    def receive_commits(self):
+        """ Receive chunks committed since the previous call, returning
+        the new chunks.  Receiving the committed resource updates the cached
+        state of its files.
+        """
+        try:
+            with open(self.commits_filename, 'rb') as commits_file:
+                commits_file.seek(self.commits_offset)
+                data = commits_file.read()
+        except IOError:
+            return []
+        lines = data.split(b'\n')
+        self.commits_offset += len(data) - len(lines[-1])
+        chunks = list()
+        for line in lines[:-1]:
+            key, resource = pickle.loads(base64.b64decode(line))
+            if key not in self.received:
+                self.received.add(key)
+                chunks.append(key)
+        return chunks
+
+    def push(self):
+        for key, resource in self.resources.items():
+            if key not in self.committed:
+                resource.push()
+
     def __repr__(self):
         return '{0}.{1}({2},{3},{4},{5})'.format(
             FilenameCallback.__module__,
@@ -628,9 +717,10 @@ class TempSplitFileArg(Arg, SplitMergeArg):
             self.resources.append(resource)
         self.merge_inputs = list(db.nodemgr.get_merge_inputs(self.axes, self.node, subset=self.axes_origin))
         self.split_outputs = list(db.nodemgr.get_split_outputs(self.axes, self.node, subset=self.axes_origin))
+        self.is_streaming = self.get_is_streaming(kwargs.get('streaming'))
         self.filename_callback = TempFilenameCallback(
             db.file_storage, self.name, self.node, self.axes,
-            db.get_temp_filename_creator(), **kwargs)
+            db.get_temp_filename_creator(), is_streaming=self.is_streaming, **kwargs)
 
     def get_merge_inputs(self):
         return self.merge_inputs
@@ -648,9 +738,127 @@ class TempSplitFileArg(Arg, SplitMergeArg):
         if self.is_split:
             job.workflow.db.nodemgr.store_chunks(self.axes, self.node, list(self.filename_callback.resources.keys()), subset=self.axes_origin)
 
+    def receive_commits(self, job):
+        chunks = self.filename_callback.receive_commits()
+        if len(chunks) == 0:
+            return [], []
+        job.workflow.db.nodemgr.store_chunks(
+            self.axes, self.node, list(self.filename_callback.received), subset=self.axes_origin, persist=False)
+        nodes = [self.node + pypeliner.identifiers.AxisInstance(self.axes[0], chunk) for chunk in chunks]
+        created = [(self.name, node) for node in nodes]
+        partial = [(output.id, node) for output in self.split_outputs for node in nodes]
+        return created, partial
+
     def push(self):
-        for resource in self.filename_callback.resources.values():
-            resource.push()
+        self.filename_callback.push()
+
+
+class ReduceArg(Arg):
+    """ Inputs of one merge of a tree reduction
+
+    Resolves to a dictionary of the resolved input arguments, with keys as chunks of the merge axis or indices of
+    intermediate merges.
+
+    """
+
+    def __init__(self, args, merge_inputs):
+        self.args = args
+        self.merge_inputs = list(merge_inputs)
+
+    def get_inputs(self):
+        inputs = []
+        for arg in self.args.values():
+            inputs.extend(arg.get_inputs())
+        return inputs
+
+    def get_merge_inputs(self):
+        return self.merge_inputs
+
+    def resolve(self):
+        return dict((key, arg.resolve()) for key, arg in self.args.items())
+
+    def allocate(self):
+        for arg in self.args.values():
+            arg.allocate()
+
+    def pull(self):
+        for arg in self.args.values():
+            arg.pull()
+
+
+class IncrementalMerge(object):
+    """ Changes to the inputs of an incremental merge
+
+    :param previous: previous merged result, the object or the filename of the previous output, or None if all chunks
+                     are to be merged.
+    :param changed: dictionary of resolved inputs of added or changed chunks, or all chunks if previous is None.
+    :param removed: list of chunks removed since the previous merge.
+
+    """
+
+    def __init__(self, previous, changed, removed):
+        self.previous = previous
+        self.changed = changed
+        self.removed = removed
+
+
+class IncrementalMergeArg(Arg):
+    """ Input merged along a single axis by an incremental merge
+
+    Resolves to an :py:class:`IncrementalMerge` with the previous result, and only the chunks that changed since the
+    previous merge.  Createtimes of the merged chunks are recorded once the merge completes.
+
+    """
+
+    def __init__(self, merge_arg, previous_arg):
+        self.merge_arg = merge_arg
+        self.previous_arg = previous_arg
+        self.resources = list(merge_arg.resources)
+        self.inputs = list(merge_arg.get_inputs())
+        self.is_incremental = False
+        self.removed = []
+        self.record = None
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_merge_inputs(self):
+        return self.merge_arg.get_merge_inputs()
+
+    def get_createtimes(self):
+        return dict((self.merge_arg.get_node_chunks(input.node), input.createtime) for input in self.inputs)
+
+    def previous_exists(self):
+        return all(previous_input.exists for previous_input in self.previous_arg.get_inputs())
+
+    def set_changes(self, changed, removed, record):
+        """ Restrict the merge to changed chunks, or all chunks if changed is None, with record stored once the merge
+        completes.
+        """
+        self.is_incremental = changed is not None
+        self.merge_arg.resources = [resource for resource in self.resources
+                                    if changed is None or self.merge_arg.get_node_chunks(resource.node) in changed]
+        self.removed = removed
+        self.record = record
+
+    def resolve(self):
+        previous = None
+        if self.is_incremental:
+            previous = self.previous_arg.resolve()
+        return IncrementalMerge(previous, self.merge_arg.resolve(), self.removed)
+
+    def update(self, job):
+        job.db.merged_chunks.record(job.displayname, self.record)
+
+    def allocate(self):
+        self.merge_arg.allocate()
+        if self.is_incremental:
+            self.previous_arg.allocate()
+
+    def pull(self):
+        self.merge_arg.pull()
+        if self.is_incremental:
+            self.previous_arg.pull()
 
 
 class InputInstanceArg(Arg):
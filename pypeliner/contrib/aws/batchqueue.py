@@ -182,6 +182,9 @@ class AwsJobQueue(object):
                     self.completed_job_ids):
                 return self.job_names[job_id]
 
+            if immediate:
+                return None
+
     def receive(self, name):
         """
         receive finished job
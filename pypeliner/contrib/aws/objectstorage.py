@@ -69,16 +69,25 @@ class AwsObjectStorage(object):
     def get_createtime(self):
         createtime = self.createtime_cache.get()
         if createtime is None:
-            if not self.storage.exists(self.object_name):
-                createtime = 'missing'
-            else:
-                createtime = self.storage.retrieve_object_createtime(self.object_name)
-            self.createtime_cache.set(createtime)
+            createtime = self.fetch_createtime()
+            self.cache_createtime(createtime)
         if createtime == 'missing':
             return None
         createtime = datetime.datetime.strptime(createtime, '%Y/%m/%d-%H:%M:%S')
         return time.mktime(createtime.timetuple())
 
+    def is_createtime_cached(self):
+        return self.createtime_cache.get() is not None
+
+    def fetch_createtime(self):
+        """ Retrieve the createtime bypassing the cache, safe to call from any thread """
+        if not self.storage.exists(self.object_name):
+            return 'missing'
+        return self.storage.retrieve_object_createtime(self.object_name)
+
+    def cache_createtime(self, createtime):
+        self.createtime_cache.set(createtime)
+
     def touch(self):
         createtime = datetime.datetime.now().strftime('%Y/%m/%d-%H:%M:%S')
         self.storage.update_object_createtime(self.object_name, createtime)
@@ -197,6 +197,14 @@ class AzureJobQueue(object):
 
         """
 
+        if immediate:
+            finished = self.running_task_ids.intersection(self.completed_task_ids)
+            if not finished and self._update_task_state():
+                finished = self.running_task_ids.intersection(self.completed_task_ids)
+            for task_id in finished:
+                return self.job_names[task_id]
+            return None
+
         timeout = datetime.timedelta(minutes=60)
 
         while True:
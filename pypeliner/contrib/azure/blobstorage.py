@@ -1,5 +1,6 @@
 import datetime
 import os
+import threading
 import time
 
 import pypeliner.flyweight
@@ -76,17 +77,27 @@ class AzureBlob(object):
             createtime = self.createtime_cache.get()
 
         if createtime is None:
-            try:
-                createtime = self.storage.retrieve_blob_createtime(self.blob_name)
-            except BlobMissing:
-                createtime = 'missing'
-            self.createtime_cache.set(createtime)
-            self.createtime_save.set(createtime)
+            createtime = self.fetch_createtime()
+            self.cache_createtime(createtime)
         if createtime == 'missing':
             return None
         createtime = datetime.datetime.strptime(createtime, '%Y/%m/%d-%H:%M:%S')
         return time.mktime(createtime.timetuple())
 
+    def is_createtime_cached(self):
+        return self.createtime_cache.get() is not None
+
+    def fetch_createtime(self):
+        """ Retrieve the createtime bypassing the caches, safe to call from any thread """
+        try:
+            return self.storage.retrieve_blob_createtime(self.blob_name)
+        except BlobMissing:
+            return 'missing'
+
+    def cache_createtime(self, createtime):
+        self.createtime_cache.set(createtime)
+        self.createtime_save.set(createtime)
+
     def touch(self):
         createtime = datetime.datetime.now().strftime('%Y/%m/%d-%H:%M:%S')
         self.exists_cache.set(True)
@@ -111,13 +122,16 @@ class AzureBlobStorage(object):
         self.subscription_id = os.environ["SUBSCRIPTION_ID"]
         self.keyvault_account = os.environ['AZURE_KEYVAULT_ACCOUNT']
         self.blob_client = None
+        self.connect_lock = threading.Lock()
 
         metadata_prefix = kwargs.get('metadata_prefix')
         createtime_shelf_filename = metadata_prefix + 'createtimes.db'
+        in_memory = kwargs.get('in_memory', False)
         self.cached_createtimes = pypeliner.flyweight.FlyweightState()
-        pypeliner.helpers.makedirs(os.path.dirname(createtime_shelf_filename))
+        if not in_memory:
+            pypeliner.helpers.makedirs(os.path.dirname(createtime_shelf_filename))
         self.saved_createtimes = pypeliner.flyweight.FlyweightState(
-            state_container=SqliteDb(createtime_shelf_filename))
+            state_container=SqliteDb(createtime_shelf_filename, in_memory=in_memory))
         self.cached_exists = pypeliner.flyweight.FlyweightState()
 
     def connect(self, storage_account_name):
@@ -166,6 +180,7 @@ class AzureBlobStorage(object):
          self.rabbitmq_ipaddress, self.rabbitmq_vhost, self.client_id,
          self.secret_key, self.tenant_id, self.subscription_id,
          self.keyvault_account] = state
+        self.connect_lock = threading.Lock()
 
     def create_store(self, filename, **kwargs):
         kwargs['createtime_cache'] = self.cached_createtimes.create_flyweight(filename)
@@ -196,12 +211,15 @@ class AzureBlobStorage(object):
         )
 
     def retrieve_blob_createtime(self, blob_name):
-        self.connect(self.get_storage_account(blob_name))
-        createtime = self.blob_client.get_metadata(
+        # Createtimes are retrieved concurrently, possibly across accounts
+        with self.connect_lock:
+            self.connect(self.get_storage_account(blob_name))
+            blob_client = self.blob_client
+        createtime = blob_client.get_metadata(
             'create_time', blob_uri=blob_name
         )
         if not createtime:
-            return self.blob_client.get_last_modified(blob_uri=blob_name)
+            return blob_client.get_last_modified(blob_uri=blob_name)
         else:
             return createtime
 
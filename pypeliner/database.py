@@ -1,3 +1,4 @@
+import base64
 import collections
 import errno
 import itertools
@@ -5,6 +6,7 @@ import logging
 import shutil
 
 from pypeliner.sqlitedb import SqliteDb
+import dill as pickle
 import os
 
 import pypeliner.helpers
@@ -22,10 +24,21 @@ class NodeManager(object):
         self.temps_dir = temps_dir
         self.cached_chunks = dict()
 
-    def retrieve_nodes(self, axes, base_node=None):
+    def retrieve_nodes(self, axes, base_node=None, within=None):
+        """ Retrieve the nodes on the chunks of the given axes.
+
+        :param within: retrieved nodes to restrict to, only the nodes at or
+                       below these nodes are retrieved, without iterating over
+                       the chunks of other nodes.
+
+        """
         if base_node is None:
             base_node = pypeliner.identifiers.Node()
         assert isinstance(base_node, pypeliner.identifiers.Node)
+        if within is not None:
+            for node in self._retrieve_nodes_within(axes, base_node, within):
+                yield node
+            return
         if len(axes) == 0:
             yield base_node
         else:
@@ -35,6 +48,21 @@ class NodeManager(object):
                 ):
                     yield node
 
+    def _retrieve_nodes_within(self, axes, base_node, within):
+        if any(base_node[:len(node)] == node for node in within):
+            for node in self.retrieve_nodes(axes, base_node):
+                yield node
+            return
+        if len(axes) == 0:
+            return
+        depth = len(base_node)
+        children = set(
+            node[:depth + 1] for node in within
+            if len(node) > depth and node[:depth] == base_node and node[depth][0] == axes[0])
+        for child in sorted(children):
+            for node in self._retrieve_nodes_within(axes[1:], child, within):
+                yield node
+
     def get_chunks_filename(self, axis, node):
         return os.path.join(self.nodes_dir, node.subdir, axis + '_chunks')
 
@@ -59,7 +87,11 @@ class NodeManager(object):
             self.cached_chunks[(axis, node)] = chunks
         return self.cached_chunks[(axis, node)]
 
-    def store_chunks(self, axes, node, chunks, subset=None):
+    def store_chunks(self, axes, node, chunks, subset=None, persist=True):
+        """ Store the chunks of split axes.  Chunks that are not persisted are
+        only used for the current run, as for the chunks committed so far by
+        a running streaming split.
+        """
         if subset is None:
             subset = set([])
         if len(chunks) == 0:
@@ -82,13 +114,15 @@ class NodeManager(object):
                 for idx in range(level):
                     level_node += pypeliner.identifiers.AxisInstance(axes[idx], pre_chunks[idx])
                 level_chunks = set([a[level] for a in level_chunks])
-                self.store_axis_chunks(axes[level], level_node, level_chunks)
+                self.store_axis_chunks(axes[level], level_node, level_chunks, persist=persist)
 
-    def store_axis_chunks(self, axis, node, chunks):
+    def store_axis_chunks(self, axis, node, chunks, persist=True):
         for chunk in chunks:
             new_node = node + pypeliner.identifiers.AxisInstance(axis, chunk)
         chunks = sorted(chunks)
         self.cached_chunks[(axis, node)] = chunks
+        if not persist:
+            return
         filename = self.db.get_temp_filename(axis, node)
         resource = pypeliner.resources.TempObjManager(self.db.file_storage, axis, node, filename)
         resource.finalize(chunks)
@@ -181,10 +215,71 @@ class TempFilenameCreator(object):
             self.file_dir)
 
 
+class JobDurations(object):
+    """ Mean durations of jobs by job name, recorded over previous runs """
+
+    def __init__(self, filename, in_memory=False):
+        self.db = SqliteDb(filename, in_memory=in_memory)
+        self.durations = dict()
+        for name, value in self.db.iteritems():
+            mean, count = value.split()
+            self.durations[name] = (float(mean), int(count))
+        self._default = None
+
+    def close(self):
+        self.db.close()
+
+    def record(self, name, duration):
+        mean, count = self.durations.get(name, (0., 0))
+        count += 1
+        mean += (duration - mean) / count
+        self.durations[name] = (mean, count)
+        self.db[name] = '{} {}'.format(mean, count)
+        self._default = None
+
+    def __contains__(self, name):
+        return name in self.durations
+
+    def get(self, name):
+        """ Mean duration of a job, or the mean over all jobs if the job
+        has not been recorded.
+        """
+        if name in self.durations:
+            return self.durations[name][0]
+        if self._default is None:
+            means = [mean for mean, count in self.durations.values()]
+            self._default = sum(means) / len(means) if len(means) > 0 else 1.
+        return self._default
+
+
+class MergedChunks(object):
+    """ Createtimes of the inputs of incremental merges by job, recorded when
+    each merge completed.
+    """
+
+    def __init__(self, filename, in_memory=False):
+        self.db = SqliteDb(filename, in_memory=in_memory)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, name, createtimes):
+        self.db[name] = base64.b64encode(pickle.dumps(createtimes)).decode()
+
+    def get(self, name):
+        value = self.db.get(name)
+        if value is None:
+            return None
+        return pickle.loads(base64.b64decode(value))
+
+
 class WorkflowDatabase(object):
-    def __init__(self, temps_dir, workflow_dir, logs_dir, file_storage, job_shelf, path_info, instance_subdir):
+    def __init__(self, temps_dir, workflow_dir, logs_dir, file_storage, job_shelf, path_info, instance_subdir,
+                 job_durations=None, merged_chunks=None):
         self.file_storage = file_storage
         self.job_shelf = job_shelf
+        self.job_durations = job_durations
+        self.merged_chunks = merged_chunks
         self.path_info = path_info
         self.instance_subdir = instance_subdir
         self.envs_dir = os.path.join(workflow_dir, 'envs')
@@ -220,24 +315,38 @@ class PipelineLockedError(Exception):
 
 
 class WorkflowDatabaseFactory(object):
-    def __init__(self, temps_dir, workflow_dir, logs_dir, file_storage):
+    """ Factory of the databases of a workflow and its subworkflows.  If
+    in_memory, the databases are read but changes are not saved, and the
+    pipeline is not locked.
+    """
+
+    def __init__(self, temps_dir, workflow_dir, logs_dir, file_storage, in_memory=False):
         self.temps_dir = temps_dir
         self.workflow_dir = workflow_dir
         self.logs_dir = logs_dir
-        pypeliner.helpers.makedirs(self.workflow_dir)
+        self.in_memory = in_memory
+        if not in_memory:
+            pypeliner.helpers.makedirs(self.workflow_dir)
         self.file_storage = file_storage
         self.job_shelf_filename = os.path.join(self.workflow_dir, 'jobs.db')
+        self.job_durations_filename = os.path.join(self.workflow_dir, 'durations.db')
+        self.merged_chunks_filename = os.path.join(self.workflow_dir, 'merges.db')
         self.lock_directories = list()
 
     def create(self, path_info, instance_subdir):
-        self._add_lock(instance_subdir)
+        if not self.in_memory:
+            self._add_lock(instance_subdir)
         db = WorkflowDatabase(
             self.temps_dir, self.workflow_dir, self.logs_dir, self.file_storage,
-            self.job_shelf, path_info, instance_subdir)
+            self.job_shelf, path_info, instance_subdir, job_durations=self.job_durations,
+            merged_chunks=self.merged_chunks)
         return db
 
     def _add_lock(self, instance_subdir):
         lock_directory = os.path.join(self.workflow_dir, 'locks', instance_subdir, '_lock')
+        if lock_directory in self.lock_directories:
+            # Subworkflow rerun while watching inputs
+            return
         try:
             pypeliner.helpers.makedirs(os.path.join(lock_directory, os.path.pardir))
             os.mkdir(lock_directory)
@@ -249,11 +358,15 @@ class WorkflowDatabaseFactory(object):
         self.lock_directories.append(lock_directory)
 
     def __enter__(self):
-        self.job_shelf = SqliteDb(self.job_shelf_filename)
+        self.job_shelf = SqliteDb(self.job_shelf_filename, in_memory=self.in_memory)
+        self.job_durations = JobDurations(self.job_durations_filename, in_memory=self.in_memory)
+        self.merged_chunks = MergedChunks(self.merged_chunks_filename, in_memory=self.in_memory)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.job_shelf.close()
+        self.job_durations.close()
+        self.merged_chunks.close()
         for lock_directory in self.lock_directories:
             try:
                 os.rmdir(lock_directory)
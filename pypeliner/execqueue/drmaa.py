@@ -245,7 +245,7 @@ class DrmaaJobQueue(object):
         else:
             self.jobs[name] = self.create(ctx, name, sent, temps_dir)
 
-    def wait(self):
+    def wait(self, immediate=False):
         while True:
             if not self.local_queue.empty:
                 name = self.local_queue.wait(immediate=True)
@@ -260,6 +260,9 @@ class DrmaaJobQueue(object):
                     if job.finished:
                         return name
 
+                if immediate:
+                    return None
+
             time.sleep(1)
 
     def receive(self, name):
@@ -79,14 +79,14 @@ class LocalRemoteQueue(pypeliner.execqueue.base.JobQueue):
         else:
             self.local_queue.send(ctx, name, sent, temps_dir)
 
-    def wait(self):
+    def wait(self, immediate=False):
         while True:
             if not self.local_queue.empty:
                 name = self.local_queue.wait(immediate=True)
                 if name is not None:
                     self.name_islocal[name] = True
                     return name
-            return self.remote_queue.wait()
+            return self.remote_queue.wait(immediate=immediate)
 
     def receive(self, name):
         if not self.name_islocal.pop(name, False):
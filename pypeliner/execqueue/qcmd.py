@@ -45,12 +45,15 @@ class QstatJobStatus(object):
         self.qstat_time = None
         self.logger = logging.getLogger('pypeliner.execqueue')
 
-    def update(self):
+    def update(self, wait=True):
         """ Update cached job status after sleeping for remainder of polling time.
+        If not wait, only update if the polling time has elapsed.
         """
         if self.qstat_attempt_time is not None:
             time_since_attempt = time.time() - self.qstat_attempt_time
             sleep_time = max(0.0, self.qstat_period - time_since_attempt)
+            if not wait and sleep_time > 0:
+                return
             time.sleep(sleep_time)
         self.qstat_attempt_time = time.time()
         try:
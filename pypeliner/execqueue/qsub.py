@@ -268,7 +268,7 @@ class AsyncQsubJobQueue(pypeliner.execqueue.base.JobQueue):
         else:
             self.jobs[name] = self.create(ctx, name, sent, temps_dir)
 
-    def wait(self):
+    def wait(self, immediate=False):
         while True:
             if not self.local_queue.empty:
                 name = self.local_queue.wait(immediate=True)
@@ -278,6 +278,9 @@ class AsyncQsubJobQueue(pypeliner.execqueue.base.JobQueue):
             for name, job in self.jobs.items():
                 if job.finished:
                     return name
+            if immediate:
+                self.qstat.update(wait=False)
+                return None
             self.qstat.update()
 
     def receive(self, name):
@@ -33,7 +33,7 @@ class SubProcessJobQueue(pypeliner.execqueue.base.JobQueue):
         while True:
             if immediate:
                 process_id, returncode = os.waitpid(-1, os.WNOHANG)
-                if process_id is None:
+                if process_id == 0:
                     return None
             else:
                 try:
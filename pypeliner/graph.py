@@ -1,13 +1,16 @@
 import os
-import networkx
+import re
+import array
 import itertools
 import logging
 import collections
+import heapq
 import fnmatch
-import logging
 
 import pypeliner.helpers
 import pypeliner.identifiers
+import pypeliner.managed
+import pypeliner.storage
 import pypeliner.workflow
 
 
@@ -44,211 +47,900 @@ class NoJobs(Exception):
     pass
 
 
+schedules = ('breadth_first', 'depth_first', 'critical_path')
+
+
+# Job state flags
+_RUNNING = 0x01
+_COMPLETED = 0x02
+_STALE = 0x04
+_STALE_KNOWN = 0x08
+_REQUIRED = 0x10
+_REQUIRED_KNOWN = 0x20
+_OUT_OF_DATE = 0x40
+_OUT_OF_DATE_KNOWN = 0x80
+
+# Resource state flags
+_CREATED = 0x01
+
+
+class _Adjacency(object):
+    """ Lists of integers stored in compressed sparse row form.
+
+    Replacing a row appends its new values, leaving the old values as
+    garbage, and values are compacted once mostly garbage.
+    """
+
+    def __init__(self):
+        self.start = array.array('l')
+        self.end = array.array('l')
+        self.values = array.array('l')
+        self.num_values = 0
+
+    def append(self, values):
+        self.start.append(0)
+        self.end.append(0)
+        self[len(self.start) - 1] = values
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, row):
+        return self.values[self.start[row]:self.end[row]]
+
+    def __setitem__(self, row, values):
+        self.num_values -= self.end[row] - self.start[row]
+        self.start[row] = len(self.values)
+        self.values.extend(values)
+        self.end[row] = len(self.values)
+        self.num_values += self.end[row] - self.start[row]
+        if len(self.values) > 2 * self.num_values + 1024:
+            self._compact()
+
+    def _compact(self):
+        values = array.array('l')
+        for row in range(len(self.start)):
+            start = len(values)
+            values.extend(self.values[self.start[row]:self.end[row]])
+            self.start[row] = start
+            self.end[row] = len(values)
+        self.values = values
+
+
+def _is_same_resource(resource, other):
+    return type(resource) is type(other) and getattr(resource, 'filename', None) == getattr(other, 'filename', None)
+
+
 class DependencyGraph:
     """ Graph of dependencies between jobs.
+
+    Job and resource ids are interned as integers the first time they are
+    seen, and keep their integer for the lifetime of the graph.  Adjacency is
+    stored as arrays of integers indexed by job or resource, and job and
+    resource state as bit flags in byte arrays.  Job instances are held only
+    for the jobs currently in the graph, and are returned by pop_next_job.
+
+    Jobs of flattened subworkflows are added with the node of the subworkflow
+    as a namespace, qualifying their job and resource ids.  Jobs with no
+    inputs block other jobs in the same namespace until they complete.
+
+    Outputs of a running job may be committed before the job completes.
+    Partially committed outputs, such as the chunks of a streaming split,
+    are created only for the jobs on the committed nodes.
+
+    :param targets: output filenames or job name globs.  If given, only the
+                    target jobs and their ancestors are queued and checked
+                    for out of date status.
+    :param schedule: order in which ready jobs are run, either
+                     ``breadth_first`` in the order they became ready, or
+                     ``depth_first`` preferring the deepest and most recently
+                     ready jobs, finishing chains of jobs on a chunk before
+                     starting new chunks, or ``critical_path`` preferring jobs
+                     with the longest path of downstream jobs, weighted by
+                     the expected duration of each job.  Regardless of
+                     schedule, jobs with a higher ``priority`` run first.
+    :param fair_share: name of an axis across the chunks of which ready jobs
+                       are shared.  Of ready jobs with equal priority, those
+                       on the chunk with the fewest running jobs run first.
+
     """
 
-    def __init__(self):
-        self.completed = set()
-        self.created = set()
-        self.running = set()
+    def __init__(self, targets=None, schedule='breadth_first', fair_share=None):
+        if schedule not in schedules:
+            raise ValueError('unknown schedule ' + str(schedule))
+        self.jobs = dict()
+        self.job_index = dict()
+        self.job_ids = list()
+        self.job_instances = list()
+        self.job_names = collections.defaultdict(set)
+        self.job_namespaces = list()
+        self.job_inputs = _Adjacency()
+        self.job_outputs = _Adjacency()
+        self.job_producers = _Adjacency()
+        self.job_levels = array.array('l')
+        self.job_path_lengths = array.array('d')
+        self.job_state = bytearray()
+        self.unsatisfied = array.array('l')
+        self.resource_index = dict()
+        self.resource_ids = list()
+        self.resources = list()
+        self.resource_creator = array.array('l')
+        self.resource_dependants = list()
+        self.resource_state = bytearray()
+        self.inputs = set()
+        self.outputs = collections.defaultdict(set)
+        self.running_no_inputs = dict()
+        self.blocked = collections.defaultdict(list)
         self.obsolete = set()
+        self.schedule = schedule
+        self.ready = list()
+        self.ready_keys = dict()
+        self.fair_share = fair_share
+        self.share_ready = dict()
+        self.share_running = collections.Counter()
+        self.running_shares = dict()
+        self.ready_counter = itertools.count()
+        self.ready_no_inputs = collections.deque()
+        self.stale_dirty = set()
+        self.committed = dict()
+        self.targets = targets
+        self.included = None
+        self.unmatched_targets = set()
+        if targets is not None:
+            self.target_filenames = set(os.path.abspath(target) for target in targets)
+            self.included = set()
+            self.unmatched_targets = set(targets)
+
+    @staticmethod
+    def _qualify(namespace, id):
+        if namespace is None:
+            return id
+        return (namespace, id)
+
+    def _intern_job(self, job_id, namespace=None):
+        job_id = self._qualify(namespace, job_id)
+        job = self.job_index.get(job_id)
+        if job is None:
+            job = len(self.job_ids)
+            self.job_index[job_id] = job
+            self.job_ids.append(job_id)
+            self.job_instances.append(None)
+            self.job_namespaces.append(namespace)
+            self.job_inputs.append(())
+            self.job_outputs.append(())
+            self.job_producers.append(())
+            self.job_levels.append(-1)
+            self.job_path_lengths.append(0.)
+            self.job_state.append(0)
+            self.unsatisfied.append(-1)
+        return job
+
+    def _intern_resource(self, resource, namespace=None):
+        resource_id = self._qualify(namespace, resource.id)
+        res = self.resource_index.get(resource_id)
+        if res is None:
+            res = len(self.resource_ids)
+            self.resource_index[resource_id] = res
+            self.resource_ids.append(resource_id)
+            self.resources.append(resource)
+            self.resource_creator.append(-1)
+            self.resource_dependants.append(array.array('l'))
+            self.resource_state.append(0)
+        return res
 
     def regenerate(self, jobs):
         """ Create the dependency graph from a set of jobs, and pipeline inputs
         and outputs, maintaining current state.
 
         """
-        self.jobs = jobs
-        all_inputs = set((input.id for job in self.jobs.values() for input in job.inputs))
-        all_outputs = set((output.id for job in self.jobs.values() for output in job.outputs))
-        self.inputs = all_inputs.difference(all_outputs)
-        self.outputs = all_outputs.difference(all_inputs)
-
-        self.dependant_jobs = collections.defaultdict(set)
-        self.creating_job = dict()
-        for job in jobs.values():
-            for resource in job.inputs:
-                self.dependant_jobs[resource.id].add(job.id)
-            for resource in job.outputs:
-                if resource.id in self.creating_job:
-                    raise AmbiguousOutputException(resource.id, [job.id, self.creating_job[resource.id]])
-                self.creating_job[resource.id] = job.id
-        for job in jobs.values():
-            for resource in job.inputs:
-                if resource.id not in self.creating_job and resource.is_temp:
+        job_names = [job_name for namespace, job_name in self.job_names.keys() if namespace is None]
+        self.update(jobs, job_names=job_names)
+
+    def update(self, jobs, job_names=(), namespace=None):
+        """ Patch the dependency graph, replacing all jobs with the given
+        names by a new set of jobs, maintaining current state.
+
+        :param namespace: namespace of the jobs and their resources, the node
+                          of a flattened subworkflow.
+
+        """
+        removed_jobs = set()
+        for job_name in job_names:
+            removed_jobs.update(self.job_names.pop((namespace, job_name), ()))
+        for job_id in jobs.keys():
+            job = self.job_index.get(self._qualify(namespace, job_id))
+            if job is not None and self.job_instances[job] is not None:
+                removed_jobs.add(job)
+        touched_resources = self._remove_jobs(removed_jobs)
+
+        added_jobs = [self._add_job(job, namespace) for job in jobs.values()]
+        for job in added_jobs:
+            touched_resources.update(self.job_inputs[job])
+            touched_resources.update(self.job_outputs[job])
+
+        # Jobs that may have new creating jobs for their inputs
+        changed_jobs = set(added_jobs)
+        for res in touched_resources:
+            changed_jobs.update(self.resource_dependants[res])
+
+        for job in changed_jobs:
+            for resource in self.job_instances[job].inputs:
+                res = self.resource_index[self._qualify(namespace, resource.id)]
+                if self.resource_creator[res] < 0 and resource.is_temp:
                     raise AmbiguousInputException(resource.id)
 
-        # Create the graph
+        for res in touched_resources:
+            is_input = len(self.resource_dependants[res]) > 0
+            is_output = self.resource_creator[res] >= 0
+            if is_input and not is_output:
+                self.inputs.add(res)
+            else:
+                self.inputs.discard(res)
+            if is_output and not is_input:
+                self.outputs[namespace].add(res)
+            else:
+                self.outputs[namespace].discard(res)
+
+        # Pre-compute traversals of the DAG
+        for job in removed_jobs:
+            if self.job_instances[job] is None:
+                self.job_levels[job] = -1
+                self.job_producers[job] = ()
+        self._update_job_levels(changed_jobs)
+
+        # Prune to target jobs and their ancestors
+        included_jobs = self._update_included(added_jobs, changed_jobs, namespace)
+
+        # Jobs that may have new or fewer downstream jobs
+        upstream_jobs = set(changed_jobs).union(included_jobs)
+        for res in touched_resources:
+            if self.resource_creator[res] >= 0:
+                upstream_jobs.add(self.resource_creator[res])
+
+        if self.schedule == 'critical_path':
+            self._update_path_lengths(upstream_jobs)
+
+        # Assume pipeline inputs exist
+        for res in self.inputs.intersection(touched_resources):
+            self.resource_state[res] |= _CREATED
+
+        # Count unsatisfied inputs and queue new jobs that are ready
+        for job in sorted(set(added_jobs).union(included_jobs), key=lambda job: self.job_levels[job]):
+            self._queue_if_ready(job)
+
+        # Recalculate staleness of new jobs, jobs with new inputs, and
+        # jobs that may have new or fewer downstream jobs
+        self._invalidate_staleness(upstream_jobs)
+
+    def _is_target(self, job_inst):
+        """ Whether the job matches a target, removing the targets it matches
+        from the unmatched targets.
+        """
+        output_filenames = set()
+        for output in job_inst.outputs:
+            filename = getattr(output, 'filename', None)
+            if filename is not None:
+                output_filenames.add(os.path.abspath(filename))
+        is_target = False
+        for target in self.targets:
+            if (fnmatch.fnmatch(job_inst.jobname, target) or fnmatch.fnmatch(job_inst.displayname, target)
+                    or os.path.abspath(target) in output_filenames):
+                self.unmatched_targets.discard(target)
+                is_target = True
+        return is_target
+
+    def _is_included(self, job):
+        return self.included is None or job in self.included
+
+    def is_included(self, job_id, namespace=None):
+        """ Whether a job is run if required, a target or upstream of a target.
+        """
+        return self._is_included(self.job_index[self._qualify(namespace, job_id)])
+
+    def _update_included(self, added_jobs, changed_jobs, namespace):
+        """ Include new target jobs and new ancestors of included jobs,
+        returning the newly included jobs.
+
+        Jobs of flattened subworkflows are included, as the subworkflow job
+        is only run if included.
+        """
+        if self.included is None:
+            return set()
+        if namespace is not None:
+            stack = list(added_jobs)
+        else:
+            stack = [job for job in added_jobs if self._is_target(self.job_instances[job])]
+        stack.extend(job for job in changed_jobs if job in self.included)
+        visited = set()
+        while len(stack) > 0:
+            job = stack.pop()
+            if job in visited:
+                continue
+            visited.add(job)
+            stack.extend(p for p in self.job_producers[job] if p not in self.included)
+        newly_included = visited.difference(self.included)
+        self.included.update(visited)
+        return newly_included
+
+    def _add_job(self, job_inst, namespace=None):
+        job = self._intern_job(job_inst.id, namespace)
+        self.jobs[self.job_ids[job]] = job_inst
+        self.job_instances[job] = job_inst
+        self.job_names[(namespace, job_inst.jobname)].add(job)
+        inputs = set()
+        for idx, resource in enumerate(job_inst.inputs):
+            res = self._intern_resource(resource, namespace)
+            if _is_same_resource(self.resources[res], resource):
+                # Share the resource of the creating job rather than keep a copy per job
+                job_inst.inputs[idx] = self.resources[res]
+            inputs.add(res)
+        inputs = sorted(inputs)
+        outputs = list()
+        for resource in job_inst.outputs:
+            res = self._intern_resource(resource, namespace)
+            if self.resource_creator[res] >= 0:
+                raise AmbiguousOutputException(resource.id, [job_inst.id, self.job_ids[self.resource_creator[res]]])
+            self.resource_creator[res] = job
+            self.resources[res] = resource
+            outputs.append(res)
+        for res in inputs:
+            self.resource_dependants[res].append(job)
+        self.job_inputs[job] = inputs
+        self.job_outputs[job] = sorted(outputs)
+        return job
+
+    def _remove_jobs(self, jobs):
+        """ Remove jobs from the graph, returning the resources they touched.
+        """
+        touched_resources = set()
+        input_resources = set()
+        for job in jobs:
+            job_inst = self.job_instances[job]
+            del self.jobs[self.job_ids[job]]
+            self.job_instances[job] = None
+            self.job_names[(self.job_namespaces[job], job_inst.jobname)].discard(job)
+            for res in self.job_outputs[job]:
+                if self.resource_creator[res] == job:
+                    self.resource_creator[res] = -1
+            input_resources.update(self.job_inputs[job])
+            touched_resources.update(self.job_outputs[job])
+            self.job_inputs[job] = ()
+            self.job_outputs[job] = ()
+            self.unsatisfied[job] = -1
+            self.job_state[job] &= _RUNNING | _COMPLETED
+        for res in input_resources:
+            self.resource_dependants[res] = array.array(
+                'l', [job for job in self.resource_dependants[res] if job not in jobs])
+        touched_resources.update(input_resources)
+        return touched_resources
+
+    def _find_cycle(self, jobs):
+        """ Find a cycle reachable from the given jobs using an iterative
+        depth first search over jobs and the resources they create.
+        """
+        visited = set()
+        for start_job in jobs:
+            if start_job in visited:
+                continue
+            visited.add(start_job)
+            path = [start_job]
+            on_path = set(path)
+            stack = [iter(self._dependant_jobs(start_job))]
+            while len(stack) > 0:
+                for job in stack[-1]:
+                    if job in on_path:
+                        return [self.job_ids[j] for j in path[path.index(job):] + [job]]
+                    if job not in visited:
+                        visited.add(job)
+                        path.append(job)
+                        on_path.add(job)
+                        stack.append(iter(self._dependant_jobs(job)))
+                        break
+                else:
+                    stack.pop()
+                    on_path.discard(path.pop())
+        return None
+
+    def to_networkx(self):
+        """ Create a networkx graph of jobs and resources, for debugging.
+        """
+        import networkx
         G = networkx.DiGraph()
         for job in self.jobs.values():
-            # only track job names, ignore the axes value.
-            # this will keep DAG smaller and speed up cycle testing
-            job_node = ('job', job.jobname)
-            if G.has_node(job_node):
-                continue
+            job_node = ('job', job.id)
             G.add_node(job_node, job=job)
-            chunks = [v.chunk for v in job.node]
             for input in job.inputs:
-                input_chunks = [v.chunk for v in input.node]
-                if not input_chunks == chunks:
-                    continue
-                resource_node = ('resource', input.id)
-                if resource_node not in G:
-                    G.add_node(resource_node, resource=input)
-                G.add_edge(resource_node, job_node)
+                G.add_edge(('resource', input.id), job_node)
             for output in job.outputs:
-                output_chunks = [v.chunk for v in output.node]
-                if not output_chunks == chunks:
-                    continue
-                resource_node = ('resource', output.id)
-                if resource_node not in G:
-                    G.add_node(resource_node, resource=output)
-                G.add_edge(job_node, resource_node)
-
-        # Check for cycles
-        try:
-            cycles = networkx.find_cycle(G)
-        except networkx.NetworkXNoCycle:
-            cycles = []
-        if len(cycles) > 0:
-            raise DependencyCycleException(cycles[0])
+                G.add_edge(job_node, ('resource', output.id))
+        return G
 
-        # Pre-compute traversals of the DAG
-        self.jobs_forward = list(self.traverse_jobs_forward())
-        self.jobs_reverse = list(self.traverse_jobs_reverse())
+    def _update_job_levels(self, changed_jobs):
+        """ Assign each job a level greater than the levels of the jobs
+        creating its inputs.
 
-        # Assume pipeline inputs exist
-        self.created.update(self.inputs)
+        Levels from the previous update are kept for jobs whose creating
+        jobs are unchanged.  Only new or modified jobs and their descendants
+        are relevelled, in Kahn order.  Any new cycle must pass through a
+        relevelled job, and is found if some of these jobs cannot be ordered.
+        """
+        producers = dict()
+        for job in changed_jobs:
+            creators = set(self.resource_creator[res] for res in self.job_inputs[job])
+            creators.discard(-1)
+            producers[job] = array.array('l', sorted(creators))
+
+        # Jobs that are new or have new inputs, and all their descendants
+        affected = set()
+        stack = [job for job in changed_jobs
+                 if self.job_levels[job] < 0 or self.job_producers[job] != producers[job]]
+        while len(stack) > 0:
+            job = stack.pop()
+            if job in affected:
+                continue
+            affected.add(job)
+            stack.extend(self._dependant_jobs(job))
+
+        for job, job_producers in producers.items():
+            if self.job_producers[job] != job_producers:
+                self.job_producers[job] = job_producers
+
+        num_pending = dict()
+        for job in affected:
+            self.job_levels[job] = -1
+            num_pending[job] = len(affected.intersection(self.job_producers[job]))
+
+        queue = collections.deque(job for job in affected if num_pending[job] == 0)
+        while len(queue) > 0:
+            job = queue.popleft()
+            self.job_levels[job] = 1 + max([self.job_levels[p] for p in self.job_producers[job]] + [-1])
+            for dependant_job in self._dependant_jobs(job):
+                num_pending[dependant_job] -= 1
+                if num_pending[dependant_job] == 0:
+                    queue.append(dependant_job)
+
+        # Jobs on or downstream of a cycle are never ordered
+        unordered = [job for job in affected if self.job_levels[job] < 0]
+        if len(unordered) > 0:
+            raise DependencyCycleException(self._find_cycle(unordered))
+
+    def _update_path_lengths(self, jobs):
+        """ Recalculate the expected duration of the longest path starting
+        at each of the given jobs, propagating changes upstream in reverse
+        level order.
+        """
+        processed = set()
+        heap = [(-self.job_levels[job], job) for job in jobs if self.job_instances[job] is not None]
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            _, job = heapq.heappop(heap)
+            if job in processed:
+                continue
+            processed.add(job)
+            path_length = self.job_instances[job].expected_duration + max(
+                [self.job_path_lengths[d] for d in self._dependant_jobs(job)] + [0.])
+            if path_length == self.job_path_lengths[job]:
+                continue
+            self.job_path_lengths[job] = path_length
+            for producer in self.job_producers[job]:
+                heapq.heappush(heap, (-self.job_levels[producer], producer))
+
+    def job_level(self, job_id):
+        """ Level of a job, greater than the levels of the jobs creating its
+        inputs.
+        """
+        return self.job_levels[self.job_index[job_id]]
 
     def traverse_jobs_forward(self):
         """ Traverse jobs in order of execution.
         """
-        created_resources = set(self.inputs)
+        levels = collections.defaultdict(list)
+        for job_id, job_inst in self.jobs.items():
+            levels[self.job_levels[self.job_index[job_id]]].append(job_inst)
+        for level in sorted(levels.keys()):
+            for job_inst in levels[level]:
+                yield job_inst
 
-        adjacent_jobs = set()
+    def traverse_jobs_reverse(self):
+        """ Traverse jobs in reverse order of execution.
+        """
+        return reversed(list(self.traverse_jobs_forward()))
 
-        for job in self.jobs.values():
-            if len(list(job.inputs)) == 0:
-                adjacent_jobs.add(job.id)
-
-        for resource_id in created_resources:
-            for job_id in self.dependant_jobs[resource_id]:
-                adjacent_jobs.add(job_id)
-
-        while len(adjacent_jobs) > 0:
-            for job_id in list(adjacent_jobs):
-                job = self.jobs[job_id]
-                if all([i.id in created_resources for i in job.inputs]):
-                    yield job
-                    adjacent_jobs.remove(job_id)
-                    for o in job.outputs:
-                        created_resources.add(o.id)
-                        for dependent_job_id in self.dependant_jobs[o.id]:
-                            adjacent_jobs.add(dependent_job_id)
-                    break
+    @property
+    def jobs_forward(self):
+        return list(self.traverse_jobs_forward())
 
-    def traverse_jobs_reverse(self):
-        """ Traverse jobs in order of execution.
+    @property
+    def jobs_reverse(self):
+        return list(self.traverse_jobs_reverse())
+
+    def _queue_if_ready(self, job):
+        """ Count unsatisfied inputs for a pending job and queue it if it
+        is ready.
+        """
+        if self.job_state[job] & (_RUNNING | _COMPLETED) or not self._is_included(job):
+            return
+        if len(self.job_inputs[job]) == 0:
+            self.ready_no_inputs.append(job)
+            return
+        self.unsatisfied[job] = sum(1 for res in self.job_inputs[job] if not self._is_created_for(res, job))
+        if self.unsatisfied[job] == 0:
+            self._push_ready(job)
+
+    def _is_created_for(self, res, job):
+        """ A resource is created, or committed for the node of the job.
         """
-        visited_resources = set(self.outputs)
-        visited_jobs = set()
+        if self.resource_state[res] & _CREATED:
+            return True
+        if res not in self.committed:
+            return False
+        depth, nodes = self.committed[res]
+        return self.job_instances[job].node[:depth] in nodes
+
+    def _satisfy_input(self, job):
+        """ An input of a job was created, queue the job if it is ready.
+        """
+        if self.unsatisfied[job] < 0:
+            return
+        self.unsatisfied[job] -= 1
+        if self.unsatisfied[job] == 0:
+            self._push_ready(job)
+
+    def _dependant_jobs(self, job):
+        dependant_jobs = set()
+        for res in self.job_outputs[job]:
+            dependant_jobs.update(self.resource_dependants[res])
+        return dependant_jobs
+
+    def _invalidate_staleness(self, jobs):
+        """ Mark jobs for which out of date status must be recalculated.
+        """
+        for job in jobs:
+            self.job_state[job] &= ~(_OUT_OF_DATE | _OUT_OF_DATE_KNOWN) & 0xff
+            self.stale_dirty.add(job)
 
-        adjacent_resources = set()
-        adjacent_jobs = set()
+    def _is_stale(self, job):
+        """ A job is stale if it is out of date or an input is created by a
+        stale job that has not completed.
+        """
+        state = self.job_state[job]
+        if state & _COMPLETED:
+            return False
+        if not state & _OUT_OF_DATE_KNOWN:
+            state |= _OUT_OF_DATE_KNOWN
+            if self.job_instances[job].out_of_date():
+                state |= _OUT_OF_DATE
+            self.job_state[job] = state
+        if state & _OUT_OF_DATE:
+            return True
+        return any(self.job_state[p] & _STALE for p in self.job_producers[job])
+
+    def _is_required(self, job):
+        """ A job is required if it has missing outputs that are either
+        out of date or required by a stale or required downstream job.
+        """
+        if self.job_state[job] & _COMPLETED:
+            return False
+        job_stale = self.job_state[job] & _STALE
+        for res in self.job_outputs[job]:
+            if self.resources[res].exists:
+                continue
+            if job_stale:
+                return True
+            for dependant_job in self.resource_dependants[res]:
+                if self.job_state[dependant_job] & (_STALE | _REQUIRED):
+                    return True
+        return False
+
+    def _set_flag(self, job, known_flag, flag, value):
+        """ Set a memoized job flag, returning whether it was changed.
+        """
+        state = self.job_state[job]
+        if state & known_flag and bool(state & flag) == value:
+            return False
+        state |= known_flag
+        if value:
+            state |= flag
+        else:
+            state &= ~flag & 0xff
+        self.job_state[job] = state
+        return True
+
+    def _update_staleness(self):
+        """ Recalculate stale and required status for invalidated jobs,
+        propagating changes downstream then upstream in level order.
+        """
+        if len(self.stale_dirty) == 0:
+            return
+
+        dirty = set(job for job in self.stale_dirty if self.job_instances[job] is not None and self._is_included(job))
+        self.stale_dirty = set()
+
+        # Forward propagation of stale status
+        visited = set()
+        heap = [(self.job_levels[job], job) for job in dirty]
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            _, job = heapq.heappop(heap)
+            if job in visited:
+                continue
+            visited.add(job)
+            if not self._set_flag(job, _STALE_KNOWN, _STALE, self._is_stale(job)):
+                continue
+            for dependant_job in self._dependant_jobs(job):
+                if self._is_included(dependant_job):
+                    heapq.heappush(heap, (self.job_levels[dependant_job], dependant_job))
+
+        # Reverse propagation of required status
+        processed = set()
+        heap = [(-self.job_levels[job], job) for job in visited]
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            _, job = heapq.heappop(heap)
+            if job in processed:
+                continue
+            processed.add(job)
+            changed = self._set_flag(job, _REQUIRED_KNOWN, _REQUIRED, self._is_required(job))
+            if not changed and job not in visited:
+                continue
+            for producer in self.job_producers[job]:
+                if not self.job_state[producer] & _COMPLETED:
+                    heapq.heappush(heap, (-self.job_levels[producer], producer))
 
-        for job in self.jobs.values():
-            if len(list(job.outputs)) == 0:
-                adjacent_jobs.add(job.id)
-
-        for resource_id in visited_resources:
-            if resource_id in self.creating_job:
-                adjacent_jobs.add(self.creating_job[resource_id])
-
-        while len(adjacent_jobs) > 0 or len(adjacent_resources) > 0:
-            for job_id in list(adjacent_jobs):
-                job = self.jobs[job_id]
-                if all([o.id in visited_resources for o in job.outputs]):
-                    yield job
-                    adjacent_jobs.remove(job_id)
-                    visited_jobs.add(job_id)
-                    for i in job.inputs:
-                        adjacent_resources.add(i.id)
-                    break
-
-            for resource_id in list(adjacent_resources):
-                if all([job_id in visited_jobs for job_id in self.dependant_jobs[resource_id]]):
-                    adjacent_resources.remove(resource_id)
-                    visited_resources.add(resource_id)
-                    if resource_id in self.creating_job:
-                        adjacent_jobs.add(self.creating_job[resource_id])
+    def _ready_key(self, job):
+        """ Sort key of a ready job, smallest first.  Jobs are ordered by
+        priority, then by schedule, ties broken by the order jobs became ready.
+        """
+        priority = -self.job_instances[job].priority
+        if self.schedule == 'depth_first':
+            return (priority, -self.job_levels[job], -next(self.ready_counter))
+        elif self.schedule == 'critical_path':
+            return (priority, -self.job_path_lengths[job], next(self.ready_counter))
+        return (priority, next(self.ready_counter))
+
+    def _share(self, job):
+        """ Fair share of a job, the node up to its chunk on the fair share
+        axis, or None if the job is not on that axis.
+        """
+        if self.job_instances[job] is None:
+            return None
+        node = self.job_instances[job].node
+        if self.job_namespaces[job] is not None:
+            node = self.job_namespaces[job] + node
+        for idx, node_item in enumerate(node):
+            if isinstance(node_item, pypeliner.identifiers.AxisInstance) and node_item.axis == self.fair_share:
+                return node[:idx + 1]
+        return None
+
+    def _push_ready(self, job):
+        self._push_ready_entry((self._ready_key(job), job))
+
+    def _push_ready_entry(self, entry):
+        if self.fair_share is None:
+            heapq.heappush(self.ready, entry)
+            return
+        share = self._share(entry[1])
+        share_ready = self.share_ready.setdefault(share, [])
+        heapq.heappush(share_ready, entry)
+        if share_ready[0] is entry:
+            self._push_share(share)
+
+    def _push_share(self, share):
+        """ Queue a share by its head job, after a change to its head job or
+        running count.  Outdated entries are skipped when popped.
+        """
+        key = self.share_ready[share][0][0]
+        heapq.heappush(self.ready, (key[0], self.share_running[share], key, share))
+
+    def _pop_ready(self):
+        if self.fair_share is None:
+            return heapq.heappop(self.ready)
+        while len(self.ready) > 0:
+            _, running, key, share = heapq.heappop(self.ready)
+            share_ready = self.share_ready.get(share)
+            if not share_ready or share_ready[0][0] != key or self.share_running[share] != running:
+                continue
+            entry = heapq.heappop(share_ready)
+            if len(share_ready) > 0:
+                self._push_share(share)
+            else:
+                del self.share_ready[share]
+            return entry
+        return None
+
+    def _start_share(self, job):
+        if self.fair_share is None:
+            return
+        share = self._share(job)
+        self.running_shares[job] = share
+        self.share_running[share] += 1
+        if share in self.share_ready:
+            self._push_share(share)
+
+    def _stop_share(self, job):
+        if job not in self.running_shares:
+            return
+        share = self.running_shares.pop(job)
+        self.share_running[share] -= 1
+        if self.share_running[share] == 0:
+            del self.share_running[share]
+        if share in self.share_ready:
+            self._push_share(share)
 
     def pop_next_job(self):
         """ Return the id of the next job that is ready for execution.
         """
-        for job in self.jobs.values():
-            if len(job.inputs) == 0 and job.id not in self.running and job.id not in self.completed:
-                self.running.add(job.id)
-                return job
-
-        for job_id in self.running:
-            if len(self.jobs[job_id].inputs) == 0:
-                raise NoJobs()
+        while len(self.ready_no_inputs) > 0:
+            job = self.ready_no_inputs.popleft()
+            if self.job_instances[job] is None or self.job_state[job] & (_RUNNING | _COMPLETED):
+                continue
+            self.job_state[job] |= _RUNNING
+            self.running_no_inputs.setdefault(self.job_namespaces[job], set()).add(job)
+            self._start_share(job)
+            return self.job_instances[job]
+
+        while len(self.ready) > 0:
+            entry = self._pop_ready()
+            if entry is None:
+                break
+            key, job = entry
+            if self.unsatisfied[job] != 0 or self.job_state[job] & (_RUNNING | _COMPLETED):
+                continue
+            if self.job_namespaces[job] in self.running_no_inputs:
+                self.blocked[self.job_namespaces[job]].append((key, job))
+                continue
+            self._update_staleness()
+            if self.job_state[job] & _REQUIRED:
+                self.job_instances[job].is_required_downstream = True
+            self.job_state[job] |= _RUNNING
+            self.ready_keys[job] = key
+            self._start_share(job)
+            return self.job_instances[job]
 
-        resource_out_of_date = set()
+        raise NoJobs()
 
-        resource_required = set()
-        job_required = set()
+    def notify_requeued(self, job_id, namespace=None):
+        """ A popped job was not run, such as a job held back by a throttle.
+        The job is ready again, in its previous order.
+        """
+        job = self.job_index[self._qualify(namespace, job_id)]
+        if not self.job_state[job] & _RUNNING:
+            raise KeyError(job_id)
+        self.job_state[job] &= ~_RUNNING & 0xff
+        self._stop_share(job)
+        if job in self.running_no_inputs.get(namespace, ()):
+            self._unblock_namespace(job, namespace)
+            self.ready_no_inputs.appendleft(job)
+        else:
+            self._push_ready_entry((self.ready_keys.pop(job), job))
+
+    def notify_completed(self, job_id, namespace=None):
+        """ A job was completed, advance current state.
+        """
+        job = self.job_index[self._qualify(namespace, job_id)]
+        if not self.job_state[job] & _RUNNING:
+            raise KeyError(job_id)
+        self.job_state[job] = (self.job_state[job] & ~_RUNNING & 0xff) | _COMPLETED
+        self.ready_keys.pop(job, None)
+        self._stop_share(job)
+        self._unblock_namespace(job, namespace)
+        for res in self.job_inputs[job]:
+            if all(self.job_state[other_job] & _COMPLETED for other_job in self.resource_dependants[res]):
+                self.obsolete.add(self.resources[res])
+        for res in self.job_outputs[job]:
+            if len(self.resource_dependants[res]) == 0:
+                self.obsolete.add(self.resources[res])
+        self._invalidate_staleness([job])
+        self._invalidate_staleness(self._dependant_jobs(job))
+        for res in self.job_outputs[job]:
+            if self.resource_state[res] & _CREATED:
+                continue
+            for dependant_job in self.resource_dependants[res]:
+                if not self._is_created_for(res, dependant_job):
+                    self._satisfy_input(dependant_job)
+            self.resource_state[res] |= _CREATED
+            self.committed.pop(res, None)
+
+    def notify_failed(self, job_id, namespace=None):
+        """ A job failed and will not be retried.  The job remains running so
+        that it is never requeued, and jobs downstream of it are never ready,
+        but it no longer blocks other jobs in its namespace.
+        """
+        job = self.job_index[self._qualify(namespace, job_id)]
+        if not self.job_state[job] & _RUNNING:
+            raise KeyError(job_id)
+        self._stop_share(job)
+        self._unblock_namespace(job, namespace)
+
+    def _unblock_namespace(self, job, namespace):
+        if job not in self.running_no_inputs.get(namespace, ()):
+            return
+        self.running_no_inputs[namespace].discard(job)
+        if len(self.running_no_inputs[namespace]) == 0:
+            del self.running_no_inputs[namespace]
+            for key, blocked_job in self.blocked.pop(namespace, []):
+                self._push_ready_entry((key, blocked_job))
+
+    def notify_committed(self, created, partial, namespace=None):
+        """ Outputs of a running job were committed before it completed.
+
+        :param created: ids of outputs that were created.
+        :param partial: pairs of output id and node, for outputs created only
+                        for the jobs on that node.
 
-        for job in self.jobs_forward:
-            if job.id in self.completed:
+        """
+        for resource_id in created:
+            res = self.resource_index.get(self._qualify(namespace, resource_id))
+            if res is None or self.resource_state[res] & _CREATED:
                 continue
-            inputs_out_of_date = any([i.id in resource_out_of_date for i in job.inputs])
-            if job.out_of_date() or inputs_out_of_date:
-                for o in job.outputs:
-                    resource_out_of_date.add(o.id)
-                for i in job.inputs:
-                    resource_required.add(i.id)
-
-        for job in self.jobs_reverse:
-            if job.id in self.completed:
+            self.resource_state[res] |= _CREATED
+            for dependant_job in self.resource_dependants[res]:
+                self._satisfy_input(dependant_job)
+
+        committed_nodes = collections.defaultdict(set)
+        for resource_id, node in partial:
+            res = self.resource_index.get(self._qualify(namespace, resource_id))
+            if res is None or self.resource_state[res] & _CREATED:
                 continue
-            for o in job.outputs:
-                if o.id in resource_out_of_date and not o.exists:
-                    job_required.add(job.id)
-                if o.id in resource_required and not o.exists:
-                    job_required.add(job.id)
-            if job.id in job_required:
-                for i in job.inputs:
-                    resource_required.add(i.id)
-
-        for job in self.jobs_forward:
-            inputs_created = all([i.id in self.created for i in job.inputs])
-            if inputs_created and job.id not in self.running and job.id not in self.completed:
-                if job.id in job_required:
-                    job.is_required_downstream = True
-                self.running.add(job.id)
-                return self.jobs[job.id]
+            depth, nodes = self.committed.setdefault(res, (len(node), set()))
+            if node not in nodes:
+                committed_nodes[res].add(node)
+                nodes.add(node)
+        for res, nodes in committed_nodes.items():
+            depth = self.committed[res][0]
+            for dependant_job in self.resource_dependants[res]:
+                if self.job_instances[dependant_job].node[:depth] in nodes:
+                    self._satisfy_input(dependant_job)
 
-        raise NoJobs()
+    @property
+    def input_resources(self):
+        """ Resources created by no job, the inputs of the pipeline.
+        """
+        return [self.resources[res] for res in self.inputs]
 
-    def notify_completed(self, job_id):
-        """ A job was completed, advance current state.
+    def notify_inputs_changed(self, resources):
+        """ Inputs of the pipeline were modified while no jobs were running.
+        Jobs downstream of the inputs, and jobs recreating their missing inputs,
+        are no longer completed and are queued once ready.  Jobs left running by
+        a failed run are also queued.
         """
-        job = self.jobs[job_id]
-        self.running.remove(job.id)
-        self.completed.add(job.id)
-        for input in job.inputs:
-            if all([otherjob_id in self.completed for otherjob_id in self.dependant_jobs[input.id]]):
-                self.obsolete.add(input)
-        for output in job.outputs:
-            if len(self.dependant_jobs[output.id]) == 0:
-                self.obsolete.add(output)
-        self.created.update([output.id for output in job.outputs])
+        changed = set(id(resource) for resource in resources)
+        stack = [job for job in range(len(self.job_ids)) if self.job_state[job] & _RUNNING]
+        for res in self.inputs:
+            if id(self.resources[res]) in changed:
+                stack.extend(self.resource_dependants[res])
+        reset = set()
+        while len(stack) > 0:
+            job = stack.pop()
+            if job in reset or self.job_instances[job] is None:
+                continue
+            reset.add(job)
+            stack.extend(self._dependant_jobs(job))
+            for res in self.job_inputs[job]:
+                if self.resource_creator[res] >= 0 and not self.resources[res].exists:
+                    stack.append(self.resource_creator[res])
+        for job in reset:
+            if self.job_state[job] & _RUNNING:
+                self._stop_share(job)
+                self._unblock_namespace(job, self.job_namespaces[job])
+            self.job_state[job] &= ~(_RUNNING | _COMPLETED) & 0xff
+            self.ready_keys.pop(job, None)
+            self.job_instances[job].is_required_downstream = False
+            self.job_instances[job].is_requeued = False
+            self.job_instances[job].retry_idx = 0
+            for res in self.job_outputs[job]:
+                self.resource_state[res] &= ~_CREATED & 0xff
+                self.committed.pop(res, None)
+        for job in sorted(reset, key=lambda job: self.job_levels[job]):
+            self._queue_if_ready(job)
+        self._invalidate_staleness(reset)
+
+    def is_finished(self, namespace=None):
+        return all(self.resource_state[res] & _CREATED for res in self.outputs[namespace])
 
     @property
     def finished(self):
-        return all([output in self.created for output in self.outputs])
+        return self.is_finished()
 
     def cleanup_obsolete(self):
         for resource in self.obsolete:
@@ -257,32 +949,125 @@ class DependencyGraph:
 
 
 class WorkflowInstance(object):
-    def __init__(self, workflow_def, db_factory, runskip, node=pypeliner.identifiers.Node(), ctx={}, cleanup=False):
+    """ Instance of a workflow and its dependency graph.
+
+    :param flatten: add the jobs of subworkflows to the dependency graph of
+                    this workflow rather than creating a graph for each
+                    subworkflow.
+    :param parent: subworkflow job and workflow instance of which this is a
+                   flattened subworkflow.
+    :param targets: output filenames or job name globs to which execution
+                    is restricted.
+    :param schedule: order in which ready jobs are run, see
+                     :py:class:`DependencyGraph`.
+    :param fair_share: axis across the chunks of which ready jobs are shared,
+                       see :py:class:`DependencyGraph`.  Jobs are also taken
+                       from subworkflows in turn rather than in order.
+
+    """
+
+    def __init__(self, workflow_def, db_factory, runskip, node=pypeliner.identifiers.Node(), ctx={}, cleanup=False,
+                 flatten=False, parent=None, targets=None, schedule='breadth_first',
+                 fair_share=None):
         self._logger = logging.getLogger('pypeliner.workflowgraph')
         self.workflow_def = workflow_def
         self.db_factory = db_factory
         self.runskip = runskip
         self.db = db_factory.create(workflow_def.path_info, node.subdir)
         self.node = node
-        self.graph = DependencyGraph()
+        self.parent = parent
+        if parent is None:
+            self.graph = DependencyGraph(targets=targets, schedule=schedule, fair_share=fair_share)
+            self.namespace = None
+        else:
+            self.graph = parent[1].graph
+            self.namespace = node
         self.subworkflows = list()
         self.cleanup = cleanup
+        self.flatten = flatten
+        self.schedule = schedule
+        self.fair_share = fair_share
         self.regenerate()
+        if parent is None:
+            self.check_targets(final=False)
         self.ctx = workflow_def.ctx
         if ctx:
             self.ctx.update(ctx)
 
-    def regenerate(self):
+    def regenerate(self, axes=None, nodes=None):
         """ Regenerate dependency graph based on job instances.
+
+        :param axes: axes that have been redefined by a split.  If given, only
+                     jobs defined on or with arguments referencing these axes
+                     are recreated, and the dependency graph is patched.
+        :param nodes: new chunks of the axes, such as chunks committed by a
+                      streaming split.  If given, jobs defined on the axes are
+                      only created on these chunks and added to the existing
+                      jobs, jobs referencing the axes are recreated.
+
         """
+        job_defs = self.workflow_def._get_job_definitions(axes=axes)
+
+        if nodes is None:
+            recreated_defs = job_defs
+            job_insts = self.workflow_def._create_job_instances(self, self.db, job_defs=job_defs)
+        else:
+            added_defs = [job_def for job_def in job_defs if not set(axes).isdisjoint(job_def.axes)]
+            recreated_defs = [job_def for job_def in job_defs if set(axes).isdisjoint(job_def.axes)]
+            job_insts = itertools.chain(
+                self.workflow_def._create_job_instances(self, self.db, job_defs=added_defs, nodes=nodes),
+                self.workflow_def._create_job_instances(self, self.db, job_defs=recreated_defs))
 
         jobs = dict()
-        for job_inst in self.workflow_def._create_job_instances(self, self.db):
+        for job_inst in job_insts:
             if job_inst.id in jobs:
                 raise ValueError('Duplicate job ' + job_inst.displayname)
             jobs[job_inst.id] = job_inst
 
-        self.graph.regenerate(jobs)
+        if axes is None and self.namespace is None:
+            self.graph.regenerate(jobs)
+        else:
+            self.graph.update(jobs, job_names=[job_def.name for job_def in recreated_defs], namespace=self.namespace)
+
+        # Resolve createtimes up front rather than one at a time when jobs
+        # are checked for being out of date, jobs outside the targets are
+        # never checked
+        pypeliner.storage.prefetch_createtimes(
+            getattr(resource, 'store', None) for job in jobs.values()
+            if self.graph.is_included(job.id, namespace=self.namespace)
+            for resource in itertools.chain(job.input_resources, job.output_resources))
+
+    def _may_match_later(self, target):
+        """ Whether a target may be matched by jobs on chunks defined during
+        the run, by name or by an output filename templated by axes.
+        """
+        is_pattern = any(c in target for c in '*?[')
+        for job_def in self.workflow_def.job_definitions.values():
+            if len(job_def.all_axes) == 0:
+                continue
+            if is_pattern or target.split('/')[-1] == job_def.name:
+                return True
+            for mg in job_def.managed_args:
+                if isinstance(mg, pypeliner.managed.OutputFile):
+                    pattern = re.sub(r'\{[^}]*\}', '*', mg.name)
+                    if fnmatch.fnmatch(os.path.abspath(target), os.path.abspath(pattern)):
+                        return True
+        return False
+
+    def check_targets(self, final=True):
+        """ Raise if some targets matched no jobs or outputs, such as misspelled
+        targets.
+
+        :param final: whether the run is finished.  If not, only targets that
+                      cannot be matched by jobs on chunks defined during the
+                      run are reported.
+
+        """
+        unmatched = self.graph.unmatched_targets
+        if not final:
+            unmatched = [target for target in unmatched if not self._may_match_later(target)]
+        if len(unmatched) > 0:
+            raise ValueError('targets matching no jobs or outputs: ' + ' '.join(sorted(unmatched)))
 
     def finalize_workflows(self):
         """ Finalize any workflows that are finished.
@@ -301,8 +1086,17 @@ class WorkflowInstance(object):
 
     def add_subworkflow(self, job, workflow_def):
         node = self.node + job.node + pypeliner.identifiers.Namespace(job.job_def.name)
-        workflow = WorkflowInstance(workflow_def, self.db_factory, self.runskip, node=node, cleanup=self.cleanup)
-        self.subworkflows.append((job, workflow))
+        if self.flatten:
+            workflow = WorkflowInstance(
+                workflow_def, self.db_factory, self.runskip, node=node, cleanup=self.cleanup,
+                flatten=True, parent=(job, self), schedule=self.schedule,
+                fair_share=self.fair_share)
+            workflow.complete_if_finished()
+        else:
+            workflow = WorkflowInstance(
+                workflow_def, self.db_factory, self.runskip, node=node, cleanup=self.cleanup,
+                schedule=self.schedule, fair_share=self.fair_share)
+            self.subworkflows.append((job, workflow))
 
     def complete_job(self, job):
         self.db.job_shelf[job.displayname] = True
@@ -332,36 +1126,75 @@ class WorkflowInstance(object):
 
         while True:
             # Return any ready jobs from sub workflows
-            for job, workflow in self.subworkflows:
+            for idx, (job, workflow) in enumerate(self.subworkflows):
                 try:
-                    return workflow.pop_next_job()
+                    next_job = workflow.pop_next_job()
                 except NoJobs:
-                    pass
+                    continue
+                if self.fair_share is not None:
+                    self.subworkflows.append(self.subworkflows.pop(idx))
+                return next_job
 
             # Finalize finished workflows
             self.finalize_workflows()
 
             # Remove from self graph if no subgraph jobs
             job = self.graph.pop_next_job()
+            if job.is_requeued:
+                # Already checked before being requeued
+                job.is_requeued = False
+                return job
             job = self.update_ctx(job)
 
             is_run_required, explaination = self.runskip(job)
             self._logger.info(
-                'job ' + job.displayname + ' run: ' + str(is_run_required) + ' explanation: ' + explaination,
-                extra={"id": job.displayname, "type": "job", "explanation": explaination, 'task_name': job.id[1]})
+                'job %s run: %s', job.displayname, is_run_required,
+                extra={"id": job.displayname, "type": "job", 'task_name': job.id[1]})
+            # Explanations are rendered only at debug level
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug('job %s explanation: %s', job.displayname, explaination)
             if is_run_required:
                 return job
             else:
-                self.complete_job(job)
+                job.workflow.complete_job(job)
                 self._logger.info(
                     'job ' + job.displayname + ' skipped',
                     extra={"id": job.displayname, "type": "job", "status": "skipped", 'task_name': job.id[1]})
 
+    def notify_committed(self, created, partial):
+        self.graph.notify_committed(created, partial, namespace=self.namespace)
+
+    def notify_failed(self, job_id):
+        self.graph.notify_failed(job_id, namespace=self.namespace)
+
+    def requeue_job(self, job):
+        """ Return a popped job that was not run to the ready jobs, to be
+        popped again in order without being checked again.
+        """
+        job.is_requeued = True
+        self.graph.notify_requeued(job.id, namespace=self.namespace)
+
     def notify_completed(self, job_id):
-        self.graph.notify_completed(job_id)
+        self.graph.notify_completed(job_id, namespace=self.namespace)
         if self.cleanup:
             self.graph.cleanup_obsolete()
+        self.complete_if_finished()
+
+    @property
+    def input_resources(self):
+        return self.graph.input_resources
+
+    def notify_inputs_changed(self, resources):
+        self.graph.notify_inputs_changed(resources)
+
+    def complete_if_finished(self):
+        """ Complete the subworkflow job of a finished flattened subworkflow.
+        """
+        if self.parent is not None and self.finished:
+            job, workflow = self.parent
+            self.parent = None
+            workflow.complete_job(job)
 
     @property
     def finished(self):
-        return self.graph.finished
+        return self.graph.is_finished(self.namespace)
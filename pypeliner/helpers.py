@@ -211,7 +211,10 @@ class MultiLineFormatter(logging.Formatter):
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
-        return json.dumps(vars(record))
+        fields = dict(vars(record))
+        fields['msg'] = record.getMessage()
+        fields.pop('args', None)
+        return json.dumps(fields, default=str)
 
 
 def which(name):
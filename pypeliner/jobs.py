@@ -5,6 +5,8 @@ import sys
 import traceback
 
 import datetime
+import fnmatch
+import itertools
 import pypeliner.arguments
 import pypeliner.deep
 import pypeliner.helpers
@@ -69,8 +71,35 @@ class JobDefinition(object):
         else:
             return self.func
 
-    def create_job_instances(self, workflow, db):
-        for node in db.nodemgr.retrieve_nodes(self.axes):
+    @property
+    def all_axes(self):
+        """ Axes of the job and of any managed arguments """
+        if getattr(self, '_all_axes', None) is None:
+            self._all_axes = frozenset(self.axes).union(
+                *[getattr(mg, 'axes', ()) for mg in self.managed_args])
+        return self._all_axes
+
+    @property
+    def managed_args(self):
+        """ Distinct managed arguments in the order they are transformed """
+        if getattr(self, '_managed_args', None) is None:
+            managed_args = list()
+
+            def _add_managed(mg):
+                if not isinstance(mg, pypeliner.managed.Managed):
+                    return None, False
+                managed_args.append(mg)
+                return mg, True
+
+            pypeliner.deep.deeptransform(self.argset, _add_managed)
+            self._managed_args = managed_args
+        return self._managed_args
+
+    def create_job_instances(self, workflow, db, nodes=None):
+        """ Create the job instances on the chunks of the axes of the job,
+        restricted to those at or below the given nodes if specified.
+        """
+        for node in db.nodemgr.retrieve_nodes(self.axes, within=nodes):
             yield JobInstance(self, workflow, db, node)
 
 
@@ -83,42 +112,85 @@ def _pretty_date(ts):
 class JobInstance(object):
     """ Represents a job including function and arguments """
     direct_write = False
+    commits_received = False
 
     def __init__(self, job_def, workflow, db, node):
         self.job_def = job_def
         self.workflow = workflow
         self.db = db
         self.node = node
-        temps_dir = os.path.join(db.temps_dir, self.node.subdir, self.job_def.name)
-        self.store_dir = os.path.join(temps_dir, str(uuid.uuid1()))
-        self.arglist = list()
-        try:
-            self.argset = pypeliner.deep.deeptransform(
-                self.job_def.argset,
-                self._create_arg)
-        except pypeliner.managed.JobArgMismatchException as e:
-            e.job_name = self.displayname
-            raise
-        self.logs_dir = os.path.join(db.logs_dir, self.node.subdir, self.job_def.name)
+        self.store_dir = None
+        self._arglist = None
+        self._argset = None
+        self._ctx = None
         self.retry_idx = 0
-        self.ctx = job_def.ctx.copy()
         self.is_required_downstream = False
+        self.is_requeued = False
         self.init_inputs_outputs()
         self.runskip_request = None
 
-    def _create_arg(self, mg):
-        if not isinstance(mg, pypeliner.managed.Managed):
-            return None, False
-        arg = mg.create_arg(self)
-        self.arglist.append(arg)
-        return arg, True
+    @property
+    def arglist(self):
+        """ Arguments of the job, created when the job is used together with
+        its store directory, as only the inputs and outputs are kept for jobs
+        waiting in the dependency graph.
+        """
+        if self._arglist is None:
+            temps_dir = os.path.join(self.db.temps_dir, self.node.subdir, self.job_def.name)
+            self.store_dir = os.path.join(temps_dir, str(uuid.uuid1()))
+            self._arglist = self._create_args()
+        return self._arglist
+
+    def _create_args(self):
+        try:
+            return [self.create_arg(mg) for mg in self.job_def.managed_args]
+        except pypeliner.managed.JobArgMismatchException as e:
+            e.job_name = self.displayname
+            raise
+
+    def create_arg(self, mg):
+        return mg.create_arg(self)
+
+    def get_node_inputs(self):
+        return self.db.nodemgr.get_node_inputs(self.node)
+
+    @property
+    def argset(self):
+        """ Arguments of the job definition with managed arguments replaced,
+        created on first use as most jobs are never run.
+        """
+        if self._argset is None:
+            args = dict(zip([id(mg) for mg in self.job_def.managed_args], self.arglist))
+
+            def _get_arg(mg):
+                if not isinstance(mg, pypeliner.managed.Managed):
+                    return None, False
+                return args[id(mg)], True
+
+            self._argset = pypeliner.deep.deeptransform(self.job_def.argset, _get_arg)
+        return self._argset
+
+    @property
+    def ctx(self):
+        if self._ctx is None:
+            self._ctx = self.job_def.ctx.copy()
+        return self._ctx
+
+    @ctx.setter
+    def ctx(self, value):
+        self._ctx = value
+
+    @property
+    def logs_dir(self):
+        return os.path.join(self.db.logs_dir, self.node.subdir, self.job_def.name)
 
     def init_inputs_outputs(self):
         self.inputs = list()
         self.outputs = list()
         merge_inputs = list()
         split_outputs = list()
-        for arg in self.arglist:
+        # Arguments without a store directory, only their resources are kept
+        for arg in self._create_args():
             if isinstance(arg, pypeliner.arguments.Arg):
                 self.inputs.extend(arg.get_inputs())
                 self.outputs.extend(arg.get_outputs())
@@ -131,7 +203,7 @@ class JobInstance(object):
             if input_.id not in split_output_ids:
                 self.inputs.append(input_)
         self.outputs.extend(split_outputs)
-        for node_input in self.db.nodemgr.get_node_inputs(self.node):
+        for node_input in self.get_node_inputs():
             self.inputs.append(node_input)
 
     @property
@@ -162,6 +234,30 @@ class JobInstance(object):
     def already_run(self):
         return self.db.job_shelf.get(self.displayname, False)
 
+    @property
+    def expected_duration(self):
+        return self.db.job_durations.get(self.job_def.name)
+
+    @property
+    def priority(self):
+        """ Priority from the job context or matching context config overrides,
+        higher priority jobs are submitted first.
+        """
+        ctx = self.job_def.ctx if self._ctx is None else self._ctx
+        priority = ctx.get('priority', 0)
+        context_config = pypeliner.helpers.GlobalState.get("context_config")
+        if context_config:
+            for inpctx in context_config.get('context', {}).values():
+                if 'priority' not in inpctx.get('ctx', {}):
+                    continue
+                if fnmatch.fnmatch(self.displayname, inpctx["name_match"]):
+                    priority = inpctx['ctx']['priority']
+        return priority
+
+    def record_duration(self, duration):
+        if duration != '?':
+            self.db.job_durations.record(self.job_def.name, duration)
+
     def out_of_date(self):
         input_dates = [input.createtime for input in self.input_resources]
         output_dates = [output.createtime for output in self.output_resources]
@@ -175,7 +271,13 @@ class JobInstance(object):
 
         return max(input_dates) > min(output_dates)
 
-    def explain_out_of_date(self):
+    def explain_out_of_date(self, reason=None):
+        """ Explanation of whether the job is out of date, rendered when
+        converted to a string.
+        """
+        return OutOfDateExplanation(self, reason=reason)
+
+    def render_explain_out_of_date(self):
         input_dates = [input.createtime for input in self.input_resources]
         output_dates = [output.createtime for output in self.output_resources]
         try:
@@ -238,6 +340,45 @@ class JobInstance(object):
                     return True
         return False
 
+    def get_split_axes(self):
+        split_axes = set()
+        for arg in self.arglist:
+            if isinstance(arg, pypeliner.arguments.Arg):
+                split_axes.update(arg.get_split_axes())
+        return split_axes
+
+    @property
+    def is_streaming(self):
+        for arg in self.arglist:
+            if isinstance(arg, pypeliner.arguments.Arg):
+                if arg.is_streaming:
+                    return True
+        return False
+
+    def receive_commits(self):
+        """ Receive chunks committed by a running streaming split, adding the
+        jobs on these chunks to the workflow.  Returns whether any chunks
+        were committed.
+        """
+        created = list()
+        partial = list()
+        for arg in self.arglist:
+            if isinstance(arg, pypeliner.arguments.Arg):
+                arg_created, arg_partial = arg.receive_commits(self)
+                created.extend(arg_created)
+                partial.extend(arg_partial)
+        if len(created) == 0:
+            return False
+        # Jobs on the undefined chunks of the split are replaced on the first
+        # commit, after which only jobs on the committed chunks are added
+        nodes = None
+        if self.commits_received:
+            nodes = [node for name, node in created]
+        self.commits_received = True
+        self.workflow.regenerate(axes=self.get_split_axes(), nodes=nodes)
+        self.workflow.notify_committed(created, partial)
+        return True
+
     def create_callable(self):
         return JobCallable(
             self.id, self.job_def.wrapped_func, self.argset, self.arglist,
@@ -291,6 +432,24 @@ class JobInstance(object):
         return updated
 
 
+class OutOfDateExplanation(object):
+    """ Explanation of whether a job is out of date, rendered on first use
+    as explanations are only logged at debug level.
+    """
+
+    def __init__(self, job, reason=None):
+        self.job = job
+        self.reason = reason
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self.job.render_explain_out_of_date()
+            if self.reason is not None:
+                self._text = self.reason + '\n' + self._text
+        return self._text
+
+
 class JobTimer(object):
     """ Timer using a context manager """
 
@@ -506,10 +665,65 @@ class JobCallable(object):
         for arg in self.arglist:
             arg.update(job)
         if job.check_require_regenerate():
-            job.workflow.regenerate()
+            job.workflow.regenerate(axes=job.get_split_axes())
         job.workflow.complete_job(job)
 
 
+class JobBatch(object):
+    """ Jobs of the same definition submitted as a single job, and run in
+    sequence.  Each job is completed or retried individually.
+    """
+    is_streaming = False
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    @property
+    def displayname(self):
+        return '{}_batch{}'.format(self.jobs[0].displayname, len(self.jobs))
+
+    @property
+    def id(self):
+        return self.jobs[0].id
+
+    @property
+    def job_def(self):
+        return self.jobs[0].job_def
+
+    @property
+    def ctx(self):
+        return self.jobs[0].ctx
+
+    @property
+    def inputs(self):
+        return [input for job in self.jobs for input in job.inputs]
+
+    @property
+    def outputs(self):
+        return [output for job in self.jobs for output in job.outputs]
+
+    def create_callable(self):
+        return JobBatchCallable([job.create_callable() for job in self.jobs], self.ctx)
+
+    def create_exc_dir(self):
+        return self.jobs[0].create_exc_dir()
+
+
+class JobBatchCallable(object):
+    """ Callables of a batch of jobs, called in sequence """
+
+    def __init__(self, callables, ctx):
+        self.callables = callables
+        self.ctx = ctx
+        self.started = False
+        self.displaycommand = '?'
+
+    def __call__(self):
+        self.started = True
+        for job_callable in self.callables:
+            job_callable()
+
+
 def _setobj_helper(value):
     return value
 
@@ -520,8 +734,8 @@ class SetObjDefinition(JobDefinition):
             name, axes, ctx, _setobj_helper,
             CallSet(ret=obj, args=(value,)))
 
-    def create_job_instances(self, workflow, db):
-        for node in db.nodemgr.retrieve_nodes(self.axes):
+    def create_job_instances(self, workflow, db, nodes=None):
+        for node in db.nodemgr.retrieve_nodes(self.axes, within=nodes):
             yield SetObjInstance(self, workflow, db, node)
 
 
@@ -535,9 +749,179 @@ class SetObjInstance(JobInstance):
         self.obj_displayname = obj_res.build_displayname(workflow.node)
 
 
+_merge_input_args = (
+    pypeliner.arguments.MergeFileArg,
+    pypeliner.arguments.TempMergeFileArg,
+    pypeliner.arguments.TempMergeObjArg,
+)
+
+_merge_output_args = {
+    pypeliner.arguments.OutputFileArg: pypeliner.arguments.InputFileArg,
+    pypeliner.arguments.TempOutputFileArg: pypeliner.arguments.TempInputFileArg,
+    pypeliner.arguments.TempOutputObjArg: pypeliner.arguments.TempInputObjArg,
+}
+
+
+class MergeJobDefinition(JobDefinition):
+    """ Represents a job with a single input merged along one axis and a single
+    output of the same kind.
+    """
+
+    def __init__(self, name, axes, ctx, func, argset, sandbox=None):
+        super(MergeJobDefinition, self).__init__(name, axes, ctx, func, argset, sandbox=sandbox)
+        axes = tuple(axes)
+        merge_mgs = [mg for mg in self.managed_args
+                     if mg.splitmerge in _merge_input_args and mg.axes[:-1] == axes]
+        output_mgs = [mg for mg in self.managed_args
+                      if mg.normal in _merge_output_args and mg.axes == axes]
+        if len(merge_mgs) != 1 or len(output_mgs) != 1:
+            raise ValueError('merge job {} requires a single merge input and a single output'.format(name))
+        self.merge_mg = merge_mgs[0]
+        self.output_mg = output_mgs[0]
+        self.merge_axis = self.merge_mg.axes[-1]
+
+
+class ReduceJobDefinition(MergeJobDefinition):
+    """ Represents a merge job run as a tree of merges of at most fanin inputs.
+
+    Merging must be associative.  Intermediate merges are given consecutive
+    chunks of the merge axis, and write temporary outputs merged by the next
+    level with the group indices as keys, such that sorting by key preserves
+    the order of the chunks.
+
+    """
+
+    def __init__(self, name, axes, ctx, func, argset, sandbox=None, fanin=None):
+        super(ReduceJobDefinition, self).__init__(name, axes, ctx, func, argset, sandbox=sandbox)
+        if fanin is None or fanin < 2:
+            raise ValueError('reduce_fanin of job {} must be at least 2'.format(name))
+        self.fanin = fanin
+
+    def get_reduce_node(self, node, level, group):
+        """ Node of an intermediate merge job and its output """
+        return node + pypeliner.identifiers.AxisInstance('{}_reduce{}'.format(self.merge_axis, level), group)
+
+    def create_job_instances(self, workflow, db, nodes=None):
+        for node in db.nodemgr.retrieve_nodes(self.axes, within=nodes):
+            keys = list(db.nodemgr.retrieve_axis_chunks(self.merge_axis, node))
+            level = 0
+            while len(keys) > self.fanin:
+                num_groups = -(-len(keys) // self.fanin)
+                bounds = [len(keys) * idx // num_groups for idx in range(num_groups + 1)]
+                for group in range(num_groups):
+                    yield ReduceJobInstance(
+                        self, workflow, db, node, level, keys[bounds[group]:bounds[group + 1]], group=group)
+                keys = list(range(num_groups))
+                level += 1
+            yield ReduceJobInstance(self, workflow, db, node, level, keys)
+
+
+class ReduceJobInstance(JobInstance):
+    """ Represents one merge of a tree reduction.
+
+    :param level: level of the inputs, 0 for chunks of the merge axis, or
+                  the level of the intermediate merges otherwise.
+    :param keys: chunks or intermediate merge groups to merge.
+    :param group: group of an intermediate merge, or None for the final merge.
+
+    """
+
+    def __init__(self, job_def, workflow, db, node, level, keys, group=None):
+        self.base_node = node
+        self.level = level
+        self.keys = keys
+        self.group = group
+        if group is not None:
+            node = job_def.get_reduce_node(node, level + 1, group)
+        super(ReduceJobInstance, self).__init__(job_def, workflow, db, node)
+
+    def get_node_inputs(self):
+        return self.db.nodemgr.get_node_inputs(self.base_node)
+
+    def create_arg(self, mg):
+        if mg is self.job_def.merge_mg:
+            args = dict((key, self._create_input_arg(key)) for key in self.keys)
+            merge_inputs = self.db.nodemgr.get_merge_inputs((self.job_def.merge_axis,), self.base_node)
+            return pypeliner.arguments.ReduceArg(args, merge_inputs)
+        elif mg is self.job_def.output_mg and self.group is not None:
+            return self._create_reduced_arg(
+                pypeliner.arguments.TempOutputFileArg, pypeliner.arguments.TempOutputObjArg, self.node)
+        return mg.create_arg(self)
+
+    def _create_input_arg(self, key):
+        if self.level == 0:
+            mg = self.job_def.merge_mg
+            node = self.base_node + pypeliner.identifiers.AxisInstance(self.job_def.merge_axis, key)
+            return mg.normal(
+                self.db, mg.name, node, direct_write=self.direct_write, store_dir=self.store_dir, **mg.kwargs)
+        return self._create_reduced_arg(
+            pypeliner.arguments.TempInputFileArg, pypeliner.arguments.TempInputObjArg,
+            self.job_def.get_reduce_node(self.base_node, self.level, key))
+
+    def _create_reduced_arg(self, file_arg_class, obj_arg_class, node):
+        """ Argument for the temporary output of an intermediate merge """
+        output_mg = self.job_def.output_mg
+        if output_mg.normal == pypeliner.arguments.TempOutputObjArg:
+            return obj_arg_class(self.db, output_mg.name, node)
+        return file_arg_class(
+            self.db, os.path.basename(output_mg.name), node, direct_write=self.direct_write,
+            store_dir=self.store_dir, extensions=output_mg.kwargs.get('extensions'))
+
+
+class IncrementalJobDefinition(MergeJobDefinition):
+    """ Represents a merge job given the previous merged result and only the
+    chunks changed since the previous merge.
+    """
+
+    def create_job_instances(self, workflow, db, nodes=None):
+        for node in db.nodemgr.retrieve_nodes(self.axes, within=nodes):
+            yield IncrementalJobInstance(self, workflow, db, node)
+
+
+class IncrementalJobInstance(JobInstance):
+    """ Represents an incremental merge.  The changes are computed from the
+    createtimes of the chunks when the job is submitted, compared to those
+    recorded when the previous merge completed.
+    """
+
+    def create_arg(self, mg):
+        arg = mg.create_arg(self)
+        if mg is self.job_def.merge_mg:
+            output_mg = self.job_def.output_mg
+            previous_arg = _merge_output_args[output_mg.normal](
+                self.db, output_mg.name, self.node, direct_write=self.direct_write, store_dir=self.store_dir,
+                **output_mg.kwargs)
+            arg = pypeliner.arguments.IncrementalMergeArg(arg, previous_arg)
+        return arg
+
+    @property
+    def merge_arg(self):
+        for mg, arg in zip(self.job_def.managed_args, self.arglist):
+            if mg is self.job_def.merge_mg:
+                return arg
+
+    def create_callable(self):
+        merged_ids = set(merged_input.id for merged_input in itertools.chain(
+            self.merge_arg.get_inputs(), self.merge_arg.get_merge_inputs()))
+        record = {
+            'chunks': self.merge_arg.get_createtimes(),
+            'inputs': dict((input.id, input.createtime) for input in self.input_resources
+                           if input.id not in merged_ids),
+        }
+        previous = self.db.merged_chunks.get(self.displayname)
+        if previous is None or previous['inputs'] != record['inputs'] or not self.merge_arg.previous_exists():
+            self.merge_arg.set_changes(None, [], record)
+        else:
+            changed = set(chunk for chunk, createtime in record['chunks'].items()
+                          if previous['chunks'].get(chunk) != createtime)
+            removed = sorted(set(previous['chunks']).difference(record['chunks']))
+            self.merge_arg.set_changes(changed, removed, record)
+        return super(IncrementalJobInstance, self).create_callable()
+
+
 class SubWorkflowDefinition(JobDefinition):
-    def create_job_instances(self, workflow, db):
-        for node in db.nodemgr.retrieve_nodes(self.axes):
+    def create_job_instances(self, workflow, db, nodes=None):
+        for node in db.nodemgr.retrieve_nodes(self.axes, within=nodes):
             yield SubWorkflowInstance(self, workflow, db, node)
 
 
@@ -559,7 +943,8 @@ class SubWorkflowInstance(JobInstance):
         self.outputs = list()
         merge_inputs = list()
         split_outputs = list()
-        for arg in self.arglist:
+        # Arguments without a store directory, only their resources are kept
+        for arg in self._create_args():
             # do not keep track of return object from subworkflow. this will allow pypeliner
             # to skip subworkflow even if we dont have return object on disk as long as all
             # inputs and outputs are up to date. input_resources and output_resources are only
@@ -579,7 +964,7 @@ class SubWorkflowInstance(JobInstance):
             if input_.id not in split_output_ids:
                 self.inputs.append(input_)
         self.outputs.extend(split_outputs)
-        for node_input in self.db.nodemgr.get_node_inputs(self.node):
+        for node_input in self.get_node_inputs():
             self.inputs.append(node_input)
 
 
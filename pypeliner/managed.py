@@ -166,7 +166,9 @@ class OutputFile(Managed):
 
     For a split output, `OutputFile` will resolve to a callback function taking
     the chunk of the split axis as its only parameter and returning the filename
-    for that chunk.
+    for that chunk.  For a split on a single axis with `streaming=True`, calling
+    `commit(chunk)` on the callback once the file for a chunk is written allows
+    jobs on that chunk to start before the split job completes.
 
     """
     normal = pypeliner.arguments.OutputFileArg
@@ -318,7 +320,7 @@ class TempOutputFile(Managed):
 
     For a split output, `TempOutputFile` will resolve to a callback function taking
     the chunk of the split axis as its only parameter and returning the filename
-    for that chunk.
+    for that chunk.  Streaming splits are supported as for `OutputFile`.
 
     """
     normal = pypeliner.arguments.TempOutputFileArg
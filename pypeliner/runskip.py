@@ -12,13 +12,13 @@ class BasicRunSkip(object):
         if job.runskip_request == "skip":
             return False, 'skip requested'
         if self.rerun:
-            return True, 'rerun requested\n' + job.explain_out_of_date()
+            return True, job.explain_out_of_date('rerun requested')
         if job.out_of_date():
             return True, job.explain_out_of_date()
         if job.is_required_downstream:
-            return True, 'required downstream\n' + job.explain_out_of_date()
+            return True, job.explain_out_of_date('required downstream')
         if self.repopulate and job.output_missing():
-            return True, 'repopulate requested, missing output\n' + job.explain_out_of_date()
+            return True, job.explain_out_of_date('repopulate requested, missing output')
         return False, job.explain_out_of_date()
 
     def close(self):
@@ -33,7 +33,7 @@ class SentinalRunSkip(object):
         if job.runskip_request == "skip":
             return False, 'skip requested'
         if self.rerun:
-            return True, 'rerun requested\n' + job.explain_out_of_date()
+            return True, job.explain_out_of_date('rerun requested')
         if job.already_run():
             return False, 'already run'
         return True, 'not yet run'
@@ -42,6 +42,37 @@ class SentinalRunSkip(object):
         pass
 
 
+class PlanRunSkip(object):
+    """ Run skip decisions of a planned run in which no jobs are run.  A job
+    that would otherwise be skipped runs if its inputs would be recreated by
+    a job that runs.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.recreated = set()
+        self.explanations = dict()
+
+    def __call__(self, job):
+        is_run_required, explanation = self.default(job)
+        if not is_run_required and job.runskip_request != 'skip':
+            for input in job.input_resources:
+                filename = getattr(input, 'filename', None)
+                if filename is not None and filename in self.recreated:
+                    is_run_required = True
+                    explanation = job.explain_out_of_date('inputs recreated by upstream jobs')
+                    break
+        if is_run_required:
+            for output in job.output_resources:
+                if getattr(output, 'filename', None) is not None:
+                    self.recreated.add(output.filename)
+            self.explanations[job.displayname] = explanation
+        return is_run_required, explanation
+
+    def close(self):
+        pass
+
+
 class PatternMatcher(object):
     def __init__(self):
         self._patterns = list()
@@ -118,8 +149,8 @@ class InteractiveRunSkip(object):
         default_is_run_required, default_explaination = self.default(job)
 
         self._logger.info(
-            'job ' + job.displayname + ' default run: ' + str(
-                default_is_run_required) + ' default explanation: ' + default_explaination,
+            'job %s default run: %s default explanation: %s',
+            job.displayname, default_is_run_required, default_explaination,
             extra={
                 'job_name': job.displayname, "explanation": default_explaination,
                 'task_name': job.id[1]
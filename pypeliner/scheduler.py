@@ -3,14 +3,19 @@ Job scheduling class
 
 """
 
+import collections
 import logging
 import os
+import time
 import traceback
 
 import pypeliner
 import pypeliner.database
 import pypeliner.execqueue.base
 import pypeliner.graph
+import pypeliner.jobs
+import pypeliner.resources
+import pypeliner.runskip
 
 
 class PipelineException(Exception):
@@ -38,6 +43,13 @@ class Scheduler(object):
         self.temps_dir = './tmp'
         self.workflow_dir = './'
         self.logs_dir = './log'
+        self.flatten_subworkflows = False
+        self.schedule = 'breadth_first'
+        self.fair_share = None
+        self.streaming_poll_period = 0.5
+        self.watch_poll_period = 2.
+        self.keep_going = False
+        self.max_temp_bytes = None
         self.freeze = True
 
     def __setattr__(self, attr, value):
@@ -61,57 +73,205 @@ class Scheduler(object):
     def logs_dir(self, value):
         self._logs_dir = value
 
-    def run(self, workflow_def, exec_queue, file_storage, runskip):
+    def run(self, workflow_def, exec_queue, file_storage, runskip, targets=None):
         """ Run the pipeline
 
         :param workflow_def: workflow of jobs to be submitted.
         :param exec_queue: queue to which jobs will be submitted.  The queues implemented
                            in :py:mod:`pypeliner.execqueue` should suffice for most purposes
         :param runskip: callable object returning boolean, used to determine whether to run jobs
+        :param targets: output filenames or job name globs, restrict execution to the jobs
+                        required to create these outputs or run these jobs
 
         Call this function after adding jobs to a workflow using
         :py:func:`pypeliner.scheduler.Scheduler.transform` etc.  Jobs will be run locally or
         remotely using the `exec_queue` provided until completion.  On failure, the function
-        will wait for the remaining jobs to finish but will not submit new ones.  The first
+        will wait for the remaining jobs to finish but will not submit new ones, unless
+        `keep_going` is set, in which case only jobs downstream of failed jobs are not
+        submitted, and the pipeline fails once all other jobs are finished.  The first
         interrupt (control-C) in this function will result in the sessation of new job creation,
         and the second interrupt will attempt to cleanly cancel all jobs.
 
         """
 
-        self._active_jobs = dict()
-        self._job_exc_dirs = set()
+        self._init_run(file_storage)
         with pypeliner.database.WorkflowDatabaseFactory(
                 self.temps_dir, self.workflow_dir, self.logs_dir, file_storage
+        ) as db_factory:
+            workflow = self._create_workflow(workflow_def, db_factory, runskip, targets)
+            self._run_workflow(exec_queue, workflow)
+
+    def watch(self, workflow_def, exec_queue, file_storage, runskip, targets=None, max_reruns=None):
+        """ Run the pipeline, then keep its dependency graph in memory and rerun
+        the jobs affected by changes to its input files, until interrupted.
+
+        :param max_reruns: stop after rerunning for this many changes to inputs.
+
+        Input files are polled every `watch_poll_period` seconds.  Jobs downstream of
+        changed inputs are queued again and run if out of date, together with the
+        jobs recreating any of their inputs that were cleaned up.  A failed run is
+        logged, and its failed jobs are retried once inputs change.
+
+        """
+
+        self._init_run(file_storage)
+        with pypeliner.database.WorkflowDatabaseFactory(
+                self.temps_dir, self.workflow_dir, self.logs_dir, file_storage
+        ) as db_factory:
+            workflow = self._create_workflow(workflow_def, db_factory, runskip, targets)
+            num_reruns = 0
+            while True:
+                try:
+                    self._run_workflow(exec_queue, workflow)
+                except PipelineException:
+                    pass
+                if max_reruns is not None and num_reruns >= max_reruns:
+                    return
+                self._logger.info('waiting for changes to inputs')
+                changed = self._wait_changed_inputs(workflow)
+                self._logger.info('changed inputs ' + ' '.join(resource.filename for resource in changed))
+                workflow.notify_inputs_changed(changed)
+                num_reruns += 1
+
+    def _wait_changed_inputs(self, workflow):
+        """ Poll the input files of the workflow until some have changed,
+        refreshing their cached createtimes, and return them.
+        """
+        inputs = [resource for resource in workflow.input_resources
+                  if isinstance(resource, pypeliner.resources.UserResource) and resource.store is not None]
+        while True:
+            time.sleep(self.watch_poll_period)
+            changed = list()
+            for resource in inputs:
+                createtime = resource.createtime
+                resource.store.cache_createtime(resource.store.fetch_createtime())
+                if resource.createtime != createtime:
+                    changed.append(resource)
+            if len(changed) > 0:
+                return changed
+
+    def plan(self, workflow_def, file_storage, runskip, targets=None):
+        """ Plan a run of the pipeline without running any jobs
+
+        :param workflow_def: workflow of jobs to be planned.
+        :param file_storage: storage of files, created with `in_memory` so that file
+                             createtimes are not saved.
+        :param runskip: callable object returning boolean, used to determine whether to run jobs
+        :param targets: output filenames or job name globs, as for :py:meth:`run`
+
+        Returns a dictionary with the jobs that would run, in the order they would be
+        submitted, with why they would run, their context, and their mean duration in
+        seconds over previous runs, together with the estimated cpu hours of all jobs and
+        the estimated wall time in hours with `max_jobs` parallel jobs.  Jobs using the
+        outputs of jobs that would run are assumed to run.  Jobs on axes split by jobs
+        that would run are planned for the chunks of the previous run, and the jobs of
+        subworkflows that would run are not planned.  The databases of the pipeline are
+        read but not written, and the pipeline is not locked.
+
+        """
+
+        runskip = pypeliner.runskip.PlanRunSkip(runskip)
+        planned_jobs = list()
+        cpu_seconds = 0.
+        total_seconds = 0.
+        finish_seconds = dict()
+        with pypeliner.database.WorkflowDatabaseFactory(
+                self.temps_dir, self.workflow_dir, self.logs_dir, file_storage, in_memory=True
         ) as db_factory:
             workflow = pypeliner.graph.WorkflowInstance(
-                workflow_def, db_factory, runskip, ctx=workflow_def.ctx, cleanup=self.cleanup
+                workflow_def, db_factory, runskip, ctx=workflow_def.ctx, cleanup=False,
+                flatten=self.flatten_subworkflows, targets=targets, schedule=self.schedule,
+                fair_share=self.fair_share
             )
-            failing = False
-            try:
+            while True:
                 try:
-                    while True:
-                        self._add_jobs(exec_queue, workflow)
-                        if exec_queue.empty:
-                            break
+                    job = workflow.pop_next_job()
+                except pypeliner.graph.NoJobs:
+                    break
+                duration = job.expected_duration
+                cpu_seconds += duration * job.ctx.get('ncpus', 1)
+                total_seconds += duration
+
+                # Longest chain of planned jobs ending at this job
+                start = max([finish_seconds.get(getattr(input, 'filename', None), 0.) for input in job.input_resources] + [0.])
+                for output in job.output_resources:
+                    if getattr(output, 'filename', None) is not None:
+                        finish_seconds[output.filename] = start + duration
+
+                planned_jobs.append({
+                    'name': job.displayname,
+                    'explanation': str(runskip.explanations[job.displayname]),
+                    'ctx': job.ctx,
+                    'duration': duration,
+                    'duration_recorded': job.job_def.name in job.db.job_durations,
+                })
+                job.workflow.notify_completed(job.id)
+            workflow.check_targets()
+
+        critical_seconds = max(list(finish_seconds.values()) + [0.])
+        return {
+            'jobs': planned_jobs,
+            'num_jobs': len(planned_jobs),
+            'cpu_hours': cpu_seconds / 3600.,
+            'wall_hours': max(critical_seconds, total_seconds / self.max_jobs) / 3600.,
+        }
+
+    def _init_run(self, file_storage):
+        self._active_jobs = dict()
+        self._throttle_usage = collections.Counter()
+        context_config = pypeliner.helpers.GlobalState.get('context_config')
+        self._throttle_limits = (context_config or {}).get('throttle', {})
+        if self.max_temp_bytes is not None and not hasattr(file_storage, 'temp_bytes'):
+            raise ValueError('max_temp_bytes is not supported by storage {}'.format(type(file_storage).__name__))
+        self._file_storage = file_storage
+
+    def _create_workflow(self, workflow_def, db_factory, runskip, targets):
+        return pypeliner.graph.WorkflowInstance(
+            workflow_def, db_factory, runskip, ctx=workflow_def.ctx, cleanup=self.cleanup,
+            flatten=self.flatten_subworkflows, targets=targets, schedule=self.schedule,
+            fair_share=self.fair_share
+        )
+
+    def _run_workflow(self, exec_queue, workflow):
+        """ Submit the ready jobs of the workflow until none remain.
+        """
+        self._job_exc_dirs = set()
+        failing = False
+        try:
+            try:
+                while True:
+                    self._add_jobs(exec_queue, workflow)
+                    if exec_queue.empty:
+                        break
+                    try:
                         self._wait_next_job(exec_queue, workflow)
+                    except pypeliner.graph.IncompleteJobException:
+                        if not self.keep_going:
+                            raise
+                        failing = True
+            except KeyboardInterrupt as e:
+                raise
+            except Exception:
+                failing = True
+                self._logger.error('exception\n' + traceback.format_exc())
+            while not exec_queue.empty:
+                try:
+                    self._wait_next_job(exec_queue, workflow)
                 except KeyboardInterrupt as e:
                     raise
                 except Exception:
-                    failing = True
                     self._logger.error('exception\n' + traceback.format_exc())
-                while not exec_queue.empty:
-                    try:
-                        self._wait_next_job(exec_queue, workflow)
-                    except KeyboardInterrupt as e:
-                        raise
-                    except Exception:
-                        self._logger.error('exception\n' + traceback.format_exc())
-            except KeyboardInterrupt as e:
-                self._logger.error('interrupted')
-                raise
-            if failing:
-                self._logger.error('pipeline failed')
-                raise PipelineException('pipeline failed')
+        except KeyboardInterrupt as e:
+            self._logger.error('interrupted')
+            raise
+        if failing:
+            self._logger.error('pipeline failed')
+            raise PipelineException('pipeline failed')
+        try:
+            workflow.check_targets()
+        except ValueError as e:
+            self._logger.error(str(e))
+            raise PipelineException('pipeline failed')
 
     def _add_job(self, exec_queue, job):
         sent = job.create_callable()
@@ -146,6 +306,32 @@ class Scheduler(object):
         sent.version = pypeliner.__version__
 
         exec_queue.send(job.ctx, job.displayname, sent, exc_dir)
+        self._throttle_usage.update(job.ctx.get('throttle', {}))
+
+    def _is_throttled(self, job):
+        """ Running the job would exceed the limit of a named throttle.  A job
+        requiring more than the limit is run only when the throttle is unused.
+        Jobs producing temporary files are also held while the temporary files
+        created exceed max_temp_bytes.
+        """
+        for name, amount in job.ctx.get('throttle', {}).items():
+            limit = self._throttle_limits.get(name)
+            if limit is None or self._throttle_usage[name] == 0:
+                continue
+            if self._throttle_usage[name] + amount > limit:
+                return True
+        if self.max_temp_bytes is not None and self._is_temp_producer(job):
+            if self._file_storage.temp_bytes >= self.max_temp_bytes:
+                return True
+        return False
+
+    def _is_temp_producer(self, job):
+        """ The job creates temporary files without consuming any, so that
+        running it cannot free temp space.
+        """
+        def _is_temp_file(resource):
+            return isinstance(resource, pypeliner.resources.TempFileResource)
+        return any(map(_is_temp_file, job.outputs)) and not any(map(_is_temp_file, job.inputs))
 
     def _retry_job(self, exec_queue, job):
         if not job.retry():
@@ -159,12 +345,55 @@ class Scheduler(object):
         return True
 
     def _add_jobs(self, exec_queue, workflow):
-        while exec_queue.length < self.max_jobs:
+        """ Submit ready jobs up to max_jobs.  Throttled jobs are returned to
+        the ready jobs once no more jobs can be submitted, so that they are
+        submitted in order once no longer throttled.
+        """
+        throttled_jobs = []
+        try:
+            while exec_queue.length < self.max_jobs:
+                try:
+                    job = workflow.pop_next_job()
+                except pypeliner.graph.NoJobs:
+                    if exec_queue.empty and len(throttled_jobs) > 0:
+                        # Exceed the temp space budget rather than stall
+                        self._add_job(exec_queue, throttled_jobs.pop(0))
+                    return
+                if self._is_throttled(job):
+                    self._logger.debug('job ' + job.displayname + ' throttled')
+                    throttled_jobs.append(job)
+                    continue
+                if job.ctx.get('batch_size', 1) > 1 and not job.is_streaming:
+                    batch = self._pop_batch(workflow, job)
+                    if len(batch) > 1:
+                        job = pypeliner.jobs.JobBatch(batch)
+                self._add_job(exec_queue, job)
+        finally:
+            for job in reversed(throttled_jobs):
+                job.workflow.requeue_job(job)
+
+    def _pop_batch(self, workflow, job):
+        """ Pop ready jobs of the same definition as job, up to its batch size,
+        to be submitted with it as a single job.  Popping stops at the first
+        job of another definition, which is requeued and popped next, so that
+        jobs are submitted in schedule order.
+        """
+        def _is_batched(other_job):
+            return (other_job.job_def is job.job_def and other_job.workflow is job.workflow
+                    and not other_job.is_streaming)
+
+        batch = [job]
+        batch_size = job.ctx['batch_size']
+        while len(batch) < batch_size:
             try:
-                job = workflow.pop_next_job()
+                next_job = workflow.pop_next_job()
             except pypeliner.graph.NoJobs:
-                return
-            self._add_job(exec_queue, job)
+                break
+            if not _is_batched(next_job):
+                next_job.workflow.requeue_job(next_job)
+                break
+            batch.append(next_job)
+        return batch
 
     def _handle_error(self, job, error, error_str, exec_queue):
         pypeliner.helpers.log_event(
@@ -174,18 +403,45 @@ class Scheduler(object):
             level='err',
         )
         if not self._retry_job(exec_queue, job):
+            job.workflow.notify_failed(job.id)
+            if self.keep_going:
+                self._logger.error('job ' + job.displayname + ' failed, continuing with independent jobs')
             raise pypeliner.graph.IncompleteJobException()
 
 
+    def _wait(self, exec_queue):
+        """ Wait for a job to finish and return its name.  While streaming splits
+        are running, return None early if they commit chunks, so that jobs on
+        these chunks can be submitted.
+        """
+        streaming_jobs = [job for job in self._active_jobs.values() if job.is_streaming]
+        if len(streaming_jobs) == 0:
+            return exec_queue.wait()
+        while True:
+            name = exec_queue.wait(immediate=True)
+            if name is not None:
+                return name
+            committed = [job.receive_commits() for job in streaming_jobs]
+            if any(committed):
+                return None
+            time.sleep(self.streaming_poll_period)
+
     def _wait_next_job(self, exec_queue, workflow):
 
-        name = exec_queue.wait()
+        name = self._wait(exec_queue)
+        if name is None:
+            return
 
         job = self._active_jobs[name]
         del self._active_jobs[name]
+        self._throttle_usage.subtract(job.ctx.get('throttle', {}))
 
         assert job is not None
 
+        if isinstance(job, pypeliner.jobs.JobBatch):
+            self._receive_batch(exec_queue, name, job)
+            return
+
         try:
             received = exec_queue.receive(name)
             received.collect_logs()
@@ -206,6 +462,40 @@ class Scheduler(object):
             self._handle_error(job, traceback.format_exc(), 'collect logs error\n', exec_queue)
             return
 
+        self._complete_job(job, received)
+
+    def _receive_batch(self, exec_queue, name, batch):
+        """ Complete the jobs of a batch that finished, and retry the others
+        individually.
+        """
+        try:
+            received = exec_queue.receive(name)
+            error = None
+        except pypeliner.execqueue.base.ReceiveError:
+            received = None
+            error = traceback.format_exc()
+        failed = False
+        for idx, job in enumerate(batch.jobs):
+            try:
+                if received is None:
+                    self._handle_error(job, error, "submit error\n", exec_queue)
+                    continue
+                job_received = received.callables[idx]
+                try:
+                    job_received.collect_logs()
+                except Exception:
+                    self._handle_error(job, traceback.format_exc(), 'collect logs error\n', exec_queue)
+                    continue
+                if not job_received.finished:
+                    self._handle_error(job, job_received.log_text(), "failed to complete\n", exec_queue)
+                    continue
+                self._complete_job(job, job_received)
+            except pypeliner.graph.IncompleteJobException:
+                failed = True
+        if failed:
+            raise pypeliner.graph.IncompleteJobException()
+
+    def _complete_job(self, job, received):
         if job.id != received.id:
             raise JobIdMismatchError('job id {} doesnt match received id {}'.format(job.id, received.id))
 
@@ -239,4 +529,5 @@ class Scheduler(object):
             logger=self._logger
         )
 
+        job.record_duration(received.duration)
         received.finalize(job)
@@ -1,3 +1,4 @@
+import os
 import sqlite3
 
 
@@ -8,8 +9,16 @@ class SqliteDb(object):
     :type filename: any
     """
 
-    def __init__(self, filename):
-        self.conn = sqlite3.connect(filename)
+    def __init__(self, filename, in_memory=False):
+        if in_memory:
+            # Copy of the database discarding changes, leaving the file untouched
+            self.conn = sqlite3.connect(':memory:')
+            if os.path.exists(filename):
+                source = sqlite3.connect(filename)
+                self.conn.executescript('\n'.join(source.iterdump()))
+                source.close()
+        else:
+            self.conn = sqlite3.connect(filename)
         self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key text unique, value text)")
         self.c = self.conn.cursor()
 
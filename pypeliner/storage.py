@@ -1,4 +1,5 @@
 import importlib
+import multiprocessing.pool
 
 from pypeliner.sqlitedb import SqliteDb
 import os
@@ -81,6 +82,21 @@ class RegularFile(object):
             createtime = float(createtime)
         return createtime
 
+    def is_createtime_cached(self):
+        return self.createtime_cache.get() is not None or self.exists_cache.get() is False
+
+    def fetch_createtime(self):
+        """ Retrieve the createtime bypassing the caches, safe to call from any thread """
+        if not os.path.exists(self.filename):
+            return None
+        return os.path.getmtime(self.filename)
+
+    def cache_createtime(self, createtime):
+        self.exists_cache.set(createtime is not None)
+        self.createtime_cache.set(createtime)
+        if createtime is not None:
+            self.createtime_save.set(createtime)
+
     def touch(self):
         pypeliner.helpers.touch(self.filename)
         self.exists_cache.set(True)
@@ -93,6 +109,19 @@ class RegularFile(object):
 
 
 class RegularTempFile(RegularFile):
+    def __init__(
+            self, filename, exists_cache, createtime_cache, createtime_save,
+            size_cache=None, **kwargs
+    ):
+        super(RegularTempFile, self).__init__(
+            filename, exists_cache, createtime_cache, createtime_save, **kwargs)
+        self.size_cache = size_cache
+
+    def push(self):
+        super(RegularTempFile, self).push()
+        if self.size_cache is not None:
+            self.size_cache.set(os.path.getsize(self.filename))
+
     def get_createtime(self):
         if super(RegularTempFile, self).get_exists():
             return float(super(RegularTempFile, self).get_createtime())
@@ -103,27 +132,52 @@ class RegularTempFile(RegularFile):
 
     def delete(self):
         pypeliner.helpers.saferemove(self.filename)
+        if self.size_cache is not None:
+            self.size_cache.set(0)
+
+
+class TempSizes(dict):
+    """ Sizes of temporary files by filename, with a running total """
+    total = 0
+
+    def __setitem__(self, filename, size):
+        self.total += size - self.get(filename, 0)
+        super(TempSizes, self).__setitem__(filename, size)
+
+    def __delitem__(self, filename):
+        self.total -= self.get(filename, 0)
+        super(TempSizes, self).__delitem__(filename)
 
 
 class FileStorage(object):
-    def __init__(self, metadata_prefix=None, **kwargs):
+    def __init__(self, metadata_prefix=None, in_memory=False, **kwargs):
         createtime_shelf_filename = metadata_prefix + 'createtimes.db'
-        pypeliner.helpers.makedirs(os.path.dirname(createtime_shelf_filename))
+        if not in_memory:
+            pypeliner.helpers.makedirs(os.path.dirname(createtime_shelf_filename))
         self.cached_exists = pypeliner.flyweight.FlyweightState()
         self.cached_createtimes = pypeliner.flyweight.FlyweightState()
         self.saved_createtimes = pypeliner.flyweight.FlyweightState(
-            state_container=SqliteDb(createtime_shelf_filename))
+            state_container=SqliteDb(createtime_shelf_filename, in_memory=in_memory))
+        self.temp_sizes = TempSizes()
+        self.cached_temp_sizes = pypeliner.flyweight.FlyweightState(state_container=self.temp_sizes)
 
     def __enter__(self):
         self.cached_exists.__enter__()
         self.cached_createtimes.__enter__()
         self.saved_createtimes.__enter__()
+        self.cached_temp_sizes.__enter__()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.cached_exists.__exit__(exc_type, exc_value, traceback)
         self.cached_createtimes.__exit__(exc_type, exc_value, traceback)
         self.saved_createtimes.__exit__(exc_type, exc_value, traceback)
+        self.cached_temp_sizes.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def temp_bytes(self):
+        """ Total size of the temporary files pushed and not yet deleted """
+        return self.temp_sizes.total
 
     def _create_store(self, filename, factory, **kwargs):
         exists_cache = self.cached_exists.create_flyweight(filename)
@@ -133,12 +187,47 @@ class FileStorage(object):
 
     def create_store(self, filename, is_temp=False, **kwargs):
         if is_temp:
-            return self._create_store(filename, RegularTempFile, **kwargs)
+            size_cache = self.cached_temp_sizes.create_flyweight(filename)
+            return self._create_store(filename, RegularTempFile, size_cache=size_cache, **kwargs)
         else:
             return self._create_store(filename, RegularFile, **kwargs)
 
 
-def create(requested_storage, workflow_dir=None):
+default_createtime_threads = 16
+
+
+def prefetch_createtimes(stores):
+    """ Retrieve the createtimes of stores not yet cached concurrently, using
+    a pool of createtime_threads threads, and fill the caches of the stores.
+    Stores without createtime caching are ignored.
+    """
+    if pypeliner.helpers.GlobalState.get('sentinel_only'):
+        return
+    uncached = dict()
+    for store in stores:
+        if store is None or not hasattr(store, 'fetch_createtime'):
+            continue
+        if store.filename not in uncached and not store.is_createtime_cached():
+            uncached[store.filename] = store
+    if len(uncached) == 0:
+        return
+    stores = list(uncached.values())
+    num_threads = pypeliner.helpers.GlobalState.get('createtime_threads', default_createtime_threads)
+    pool = multiprocessing.pool.ThreadPool(min(num_threads, len(stores)))
+    try:
+        createtimes = pool.map(lambda store: store.fetch_createtime(), stores)
+    finally:
+        pool.close()
+        pool.join()
+    # Caches may be backed by databases bound to this thread
+    for store, createtime in zip(stores, createtimes):
+        store.cache_createtime(createtime)
+
+
+def create(requested_storage, workflow_dir=None, in_memory=False):
+    """ Create a storage, with the metadata of the pipeline in workflow_dir.
+    If in_memory, metadata is read but changes are not saved.
+    """
     if requested_storage is None:
         raise Exception('No storage specified')
     elif requested_storage == 'local':
@@ -158,6 +247,6 @@ def create(requested_storage, workflow_dir=None):
 
     file_storage_prefix = os.path.join(workflow_dir, 'files_')
 
-    storage = storage_class(metadata_prefix=file_storage_prefix)
+    storage = storage_class(metadata_prefix=file_storage_prefix, in_memory=in_memory)
 
     return storage
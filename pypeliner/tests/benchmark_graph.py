@@ -0,0 +1,54 @@
+""" Benchmark construction of the dependency graph.
+
+Builds a synthetic workflow of chains of jobs, one chain per chunk of
+a single axis, and times :py:meth:`pypeliner.graph.DependencyGraph.regenerate`.
+Run as::
+
+    python -m pypeliner.tests.benchmark_graph --num_jobs 50000
+
+"""
+
+import argparse
+import time
+
+import pypeliner.graph
+import pypeliner.identifiers
+from pypeliner.tests.test_graph import MockJob, MockResource
+
+
+def create_jobs(num_chunks, chain_length):
+    source = MockResource('source', createtime=1., is_temp=False)
+    jobs = dict()
+    for chunk in range(num_chunks):
+        node = pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', chunk)
+        previous = source
+        for step in range(chain_length):
+            output = MockResource('step{}'.format(step), node=node)
+            job = MockJob('step{}'.format(step), [previous], [output], node=node)
+            jobs[job.id] = job
+            previous = output
+    return jobs
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--num_jobs', type=int, nargs='+', default=[1000, 5000, 50000])
+    argparser.add_argument('--chain_length', type=int, default=5)
+    args = argparser.parse_args()
+
+    for num_jobs in args.num_jobs:
+        jobs = create_jobs(num_jobs // args.chain_length, args.chain_length)
+        graph = pypeliner.graph.DependencyGraph()
+        start = time.time()
+        graph.regenerate(jobs)
+        print('{} jobs: regenerate {:.2f}s'.format(len(jobs), time.time() - start))
+
+        # Regenerate with an additional chain as happens after a split
+        jobs.update(create_jobs(num_jobs // args.chain_length + 1, args.chain_length))
+        start = time.time()
+        graph.regenerate(jobs)
+        print('{} jobs: second regenerate {:.2f}s'.format(len(jobs), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,24 @@ def split_file_byline(in_filename, lines_per_file, out_filename_callback, max_fi
                 for line in lines:
                     out_file.write(line)
 
+def split_file_byline_streaming(in_filename, lines_per_file, out_filename_callback, wait_filename):
+    with open(in_filename, 'r') as in_file:
+        def line_group(line, line_idx=itertools.count()):
+            return int(next(line_idx) / lines_per_file)
+        for file_idx, lines in itertools.groupby(in_file, key=line_group):
+            with open(out_filename_callback(file_idx), 'w') as out_file:
+                for line in lines:
+                    out_file.write(line)
+            out_filename_callback.commit(file_idx)
+            # Jobs on committed chunks start before the split completes
+            if file_idx == 0:
+                for _ in range(120):
+                    if os.path.exists(wait_filename):
+                        break
+                    time.sleep(0.5)
+                else:
+                    raise Exception('timed out waiting for ' + wait_filename)
+
 def split_2_file_byline(in_filename, out_filename_1, out_filename_2):
     split_file_byline(in_filename, 2, out_filename_1)
     split_file_byline(in_filename, 2, out_filename_2)
@@ -96,6 +114,43 @@ def copy_file(in_filename, out_filename):
         for line in in_file:
             out_file.write(line)
 
+def log_copy_file(in_filename, out_filename, log_filename, label):
+    copy_file(in_filename, out_filename)
+    with open(log_filename, 'a') as log_file:
+        log_file.write(label + '\n')
+
+def merge_file_byline_incremental(merge, out_filename, log_filename):
+    merged = dict()
+    if merge.previous is not None:
+        with open(merge.previous, 'r') as previous_file:
+            for line in previous_file:
+                chunk, text = line.rstrip('\n').split('\t')
+                merged[chunk] = text
+    for chunk in merge.removed:
+        del merged[chunk]
+    for chunk, in_filename in merge.changed.items():
+        with open(in_filename, 'r') as in_file:
+            merged[chunk] = in_file.read().rstrip('\n')
+    with open(out_filename, 'w') as out_file:
+        for chunk, text in sorted(merged.items()):
+            out_file.write(chunk + '\t' + text + '\n')
+    with open(log_filename, 'a') as log_file:
+        log_file.write(' '.join(sorted(merge.changed)) + ';' + ' '.join(merge.removed) + '\n')
+
+def write_pid(in_filename, out_filename):
+    with open(out_filename, 'w') as out_file:
+        out_file.write(str(os.getpid()) + '\n')
+
+def delayed_copy_file(in_filename, out_filename, delay):
+    time.sleep(delay)
+    copy_file(in_filename, out_filename)
+
+def exclusive_copy_file(in_filename, out_filename, lock_dirname):
+    os.mkdir(lock_dirname)
+    time.sleep(0.5)
+    os.rmdir(lock_dirname)
+    copy_file(in_filename, out_filename)
+
 def write_list(in_list, out_filename):
     with open(out_filename, 'w') as out_file:
         for a in sorted(in_list):
@@ -0,0 +1,431 @@
+import unittest
+
+import pypeliner.graph
+import pypeliner.identifiers
+
+
+class MockResource(object):
+    def __init__(self, name, createtime=None, is_temp=True, exists=None, node=pypeliner.identifiers.Node()):
+        self.name = name
+        self.node = node
+        self.createtime = createtime
+        self.is_temp = is_temp
+        if exists is None:
+            exists = createtime is not None
+        self.exists = exists
+
+    @property
+    def id(self):
+        return (self.name, self.node)
+
+    def cleanup(self):
+        pass
+
+
+class MockJob(object):
+    def __init__(self, name, inputs, outputs, node=pypeliner.identifiers.Node(), expected_duration=1., priority=0):
+        self.jobname = name
+        self.node = node
+        self.inputs = inputs
+        self.outputs = outputs
+        self.expected_duration = expected_duration
+        self.priority = priority
+        self.is_required_downstream = False
+        self.num_out_of_date_calls = 0
+
+    @property
+    def id(self):
+        return (self.node, self.jobname)
+
+    @property
+    def displayname(self):
+        return '/' + self.jobname
+
+    def out_of_date(self):
+        self.num_out_of_date_calls += 1
+        input_dates = [i.createtime for i in self.inputs]
+        output_dates = [o.createtime for o in self.outputs]
+        if len(input_dates) == 0 or len(output_dates) == 0:
+            return True
+        if None in input_dates or None in output_dates:
+            return True
+        return max(input_dates) > min(output_dates)
+
+
+def create_graph(jobs, **kwargs):
+    graph = pypeliner.graph.DependencyGraph(**kwargs)
+    graph.regenerate(dict((job.id, job) for job in jobs))
+    return graph
+
+
+def pop_all(graph):
+    popped = []
+    while True:
+        try:
+            popped.append(graph.pop_next_job())
+        except pypeliner.graph.NoJobs:
+            return popped
+
+
+class dependency_graph_test(unittest.TestCase):
+
+    def create_chain(self, createtimes):
+        resources = [MockResource('r{}'.format(idx), createtime=t, is_temp=(idx != 0))
+                     for idx, t in enumerate(createtimes)]
+        jobs = [MockJob('j{}'.format(idx), [resources[idx]], [resources[idx + 1]])
+                for idx in range(len(resources) - 1)]
+        return resources, jobs
+
+    def test_ready_queue_order(self):
+        resources, jobs = self.create_chain([1., None, None, None])
+        graph = create_graph(jobs)
+
+        for job in jobs:
+            popped = pop_all(graph)
+            self.assertEqual([j.id for j in popped], [job.id])
+            graph.notify_completed(job.id)
+
+        self.assertEqual(pop_all(graph), [])
+        self.assertTrue(graph.finished)
+
+    def test_diamond_waits_for_all_inputs(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        left = MockResource('left')
+        right = MockResource('right')
+        merged = MockResource('merged')
+        split_job = MockJob('split_left', [source], [left])
+        other_job = MockJob('split_right', [source], [right])
+        merge_job = MockJob('merge', [left, right], [merged])
+        graph = create_graph([merge_job, split_job, other_job])
+
+        popped = pop_all(graph)
+        self.assertEqual(set(j.id for j in popped), set([split_job.id, other_job.id]))
+
+        graph.notify_completed(split_job.id)
+        self.assertEqual(pop_all(graph), [])
+
+        graph.notify_completed(other_job.id)
+        self.assertEqual([j.id for j in pop_all(graph)], [merge_job.id])
+
+    def test_forward_order(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        stats = MockResource('stats')
+        table = MockResource('table')
+        config = MockResource('config')
+        jobs = [
+            MockJob('use', [stats, table, config], []),
+            MockJob('config', [], [config]),
+            MockJob('calc', [source], [stats, table]),
+        ]
+        graph = create_graph(jobs)
+
+        forward = [job.jobname for job in graph.jobs_forward]
+        self.assertEqual(forward[-1], 'use')
+        self.assertEqual(list(reversed(graph.jobs_reverse)), graph.jobs_forward)
+
+    def test_cycle(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        first = MockResource('first')
+        second = MockResource('second')
+        jobs = [
+            MockJob('read', [source, second], [first]),
+            MockJob('write', [first], [second]),
+            MockJob('report', [second], [MockResource('report')]),
+        ]
+
+        with self.assertRaises(pypeliner.graph.DependencyCycleException) as context:
+            create_graph(jobs)
+
+        cycle = context.exception.cycle
+        self.assertEqual(cycle[0], cycle[-1])
+        self.assertEqual(set(cycle), set([jobs[0].id, jobs[1].id]))
+
+    def test_required_downstream(self):
+        # Temporaries were cleaned up and the final output removed
+        resources, jobs = self.create_chain([1., 2., 3., None])
+        resources[1].exists = False
+        resources[2].exists = False
+        graph = create_graph(jobs)
+        self.assertFalse(jobs[0].out_of_date())
+
+        popped = pop_all(graph)
+        self.assertEqual([j.id for j in popped], [jobs[0].id])
+        self.assertTrue(popped[0].is_required_downstream)
+
+    def test_out_of_date_memoized(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        chunks = [MockResource('chunk{}'.format(idx)) for idx in range(4)]
+        results = [MockResource('result{}'.format(idx)) for idx in range(4)]
+        split_jobs = [MockJob('split{}'.format(idx), [source], [chunks[idx]]) for idx in range(4)]
+        result_jobs = [MockJob('result{}'.format(idx), [chunks[idx]], [results[idx]]) for idx in range(4)]
+        graph = create_graph(split_jobs + result_jobs)
+
+        self.assertEqual(len(pop_all(graph)), 4)
+        graph.notify_completed(split_jobs[0].id)
+        self.assertEqual([j.id for j in pop_all(graph)], [result_jobs[0].id])
+
+        # Completing a split job only invalidates its downstream job
+        self.assertEqual([job.num_out_of_date_calls for job in split_jobs], [1, 1, 1, 1])
+        self.assertEqual([job.num_out_of_date_calls for job in result_jobs], [2, 1, 1, 1])
+
+    def test_update_replaces_jobs(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        chunks = MockResource('chunks')
+        split_job = MockJob('split', [source], [chunks])
+        undefined_node = pypeliner.identifiers.create_undefined_node(('chunk',))
+        undefined_result = MockResource('result', node=undefined_node)
+        graph = create_graph([
+            split_job,
+            MockJob('transform', [chunks], [undefined_result], node=undefined_node),
+            MockJob('merge', [chunks, undefined_result], [MockResource('merged')]),
+        ])
+
+        self.assertEqual([j.id for j in pop_all(graph)], [split_job.id])
+
+        # Split defines chunks 1 and 2, patch the graph with the new jobs
+        jobs = dict()
+        results = list()
+        for chunk in (1, 2):
+            node = pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', chunk)
+            results.append(MockResource('result', node=node))
+            job = MockJob('transform', [chunks], [results[-1]], node=node)
+            jobs[job.id] = job
+        merge_job = MockJob('merge', [chunks] + results, [MockResource('merged')])
+        jobs[merge_job.id] = merge_job
+        graph.update(jobs, job_names=['transform', 'merge'])
+        graph.notify_completed(split_job.id)
+
+        self.assertEqual(len(graph.jobs), 4)
+        transform_nodes = set(job.node for job in jobs.values() if job.jobname == 'transform')
+        self.assertEqual(set(j.node for j in pop_all(graph)), transform_nodes)
+        self.assertGreater(graph.job_level(merge_job.id), graph.job_level(split_job.id) + 1)
+
+    def test_targets(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        intermediate = MockResource('intermediate')
+        report = MockResource('report')
+        report.filename = 'report.txt'
+        other = MockResource('other')
+        jobs = [
+            MockJob('prepare', [source], [intermediate]),
+            MockJob('report', [intermediate], [report]),
+            MockJob('other', [intermediate], [other]),
+        ]
+
+        for targets in (['report.txt'], ['rep*']):
+            graph = create_graph(jobs, targets=targets)
+            popped = pop_all(graph)
+            graph.notify_completed(popped[0].id)
+            popped += pop_all(graph)
+            self.assertEqual([job.jobname for job in popped], ['prepare', 'report'])
+            self.assertEqual(graph.unmatched_targets, set())
+
+        # Jobs outside the targets are never checked
+        self.assertEqual(jobs[2].num_out_of_date_calls, 0)
+
+        graph = create_graph(jobs, targets=['rep*', 'typo'])
+        self.assertEqual(graph.unmatched_targets, set(['typo']))
+
+    def create_chunk_chains(self, num_chunks, chain_length):
+        source = MockResource('source', createtime=1., is_temp=False)
+        jobs = list()
+        for chunk in range(num_chunks):
+            node = pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', chunk)
+            previous = source
+            for step in range(chain_length):
+                output = MockResource('step{}'.format(step), node=node)
+                jobs.append(MockJob('step{}'.format(step), [previous], [output], node=node))
+                previous = output
+        return jobs
+
+    def run_serially(self, graph):
+        order = list()
+        while True:
+            try:
+                job = graph.pop_next_job()
+            except pypeliner.graph.NoJobs:
+                return order
+            graph.notify_completed(job.id)
+            order.append((job.node[0].chunk, job.jobname))
+
+    def test_breadth_first(self):
+        graph = create_graph(self.create_chunk_chains(2, 3))
+        order = self.run_serially(graph)
+        self.assertEqual([step for chunk, step in order], ['step0', 'step0', 'step1', 'step1', 'step2', 'step2'])
+
+    def test_depth_first(self):
+        graph = create_graph(self.create_chunk_chains(2, 3), schedule='depth_first')
+        order = self.run_serially(graph)
+
+        # Downstream jobs of a completed chunk are run before other chunks
+        self.assertEqual([step for chunk, step in order], ['step0', 'step1', 'step2'] * 2)
+        self.assertEqual(len(set(chunk for chunk, step in order[:3])), 1)
+
+    def test_critical_path(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        jobs = [MockJob('leaf{}'.format(idx), [source], [MockResource('leaf{}'.format(idx))]) for idx in range(3)]
+        previous = source
+        for idx in range(3):
+            output = MockResource('chain{}'.format(idx))
+            jobs.append(MockJob('chain{}'.format(idx), [previous], [output]))
+            previous = output
+
+        graph = create_graph(jobs, schedule='critical_path')
+        self.assertEqual(pop_all(graph)[0].jobname, 'chain0')
+
+        # Long jobs are weighted by their expected duration
+        jobs[1].expected_duration = 10.
+        graph = create_graph(jobs, schedule='critical_path')
+        self.assertEqual(pop_all(graph)[0].jobname, 'leaf1')
+
+    def test_priority(self):
+        for schedule in pypeliner.graph.schedules:
+            jobs = self.create_chunk_chains(3, 2)
+            jobs[4].priority = 10
+            graph = create_graph(jobs, schedule=schedule)
+            order = [(job.node[0].chunk, job.jobname) for job in pop_all(graph)]
+            self.assertEqual(order[0], (2, 'step0'))
+
+        # Remaining jobs in the order they became ready
+        self.assertEqual(self.run_serially(create_graph(jobs)), [
+            (2, 'step0'), (0, 'step0'), (1, 'step0'), (2, 'step1'), (0, 'step1'), (1, 'step1')])
+
+    def test_fair_share(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        jobs = list()
+        for chunk in range(2):
+            node = pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', chunk)
+            for idx in range(3):
+                jobs.append(MockJob('job{}'.format(idx), [source], [MockResource('output{}'.format(idx), node=node)], node=node))
+
+        graph = create_graph(jobs)
+        self.assertEqual([job.node[0].chunk for job in pop_all(graph)], [0, 0, 0, 1, 1, 1])
+
+        # Ready jobs alternate between chunks
+        graph = create_graph(jobs, fair_share='chunk')
+        self.assertEqual([job.node[0].chunk for job in pop_all(graph)], [0, 1, 0, 1, 0, 1])
+
+        # The chunk with the fewest running jobs is preferred
+        graph = create_graph(jobs, fair_share='chunk')
+        running = [graph.pop_next_job() for _ in range(3)]
+        self.assertEqual([job.node[0].chunk for job in running], [0, 1, 0])
+        graph.notify_completed(running[0].id)
+        graph.notify_completed(running[2].id)
+        self.assertEqual([job.node[0].chunk for job in pop_all(graph)], [0, 1, 1])
+
+    def test_requeued(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        jobs = list()
+        for chunk in range(2):
+            node = pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', chunk)
+            for idx in range(2):
+                jobs.append(MockJob('job{}'.format(idx), [source], [MockResource('output{}'.format(idx), node=node)], node=node))
+
+        # Requeued jobs are popped again in their previous order, and are no
+        # longer counted as running for their share
+        graph = create_graph(jobs, fair_share='chunk')
+        running = [graph.pop_next_job() for _ in range(2)]
+        self.assertEqual([job.node[0].chunk for job in running], [0, 1])
+        graph.notify_requeued(running[0].id)
+        graph.notify_completed(running[1].id)
+        self.assertEqual(pop_all(graph), [running[0], jobs[3], jobs[1]])
+
+        graph = create_graph(jobs)
+        job = graph.pop_next_job()
+        graph.notify_requeued(job.id)
+        self.assertEqual(pop_all(graph), jobs)
+        graph.notify_completed(job.id)
+        self.assertRaises(KeyError, graph.notify_requeued, job.id)
+
+    def test_committed(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        chunks = MockResource('chunks')
+        nodes = [pypeliner.identifiers.Node() + pypeliner.identifiers.AxisInstance('chunk', idx) for idx in range(2)]
+        inputs = [MockResource('input', node=node) for node in nodes]
+        outputs = [MockResource('output', node=node) for node in nodes]
+        split_job = MockJob('split', [source], [chunks] + inputs)
+        transform_jobs = [MockJob('transform', [chunks, inputs[idx]], [outputs[idx]], node=nodes[idx]) for idx in range(2)]
+        merge_job = MockJob('merge', [chunks] + outputs, [MockResource('merged')])
+        graph = create_graph([split_job, merge_job] + transform_jobs)
+        self.assertEqual(pop_all(graph), [split_job])
+
+        # Jobs on a committed chunk start before the split completes
+        graph.notify_committed([inputs[0].id], [(chunks.id, nodes[0])])
+        self.assertEqual(pop_all(graph), [transform_jobs[0]])
+        graph.notify_completed(transform_jobs[0].id)
+        self.assertEqual(pop_all(graph), [])
+
+        graph.notify_completed(split_job.id)
+        self.assertEqual(pop_all(graph), [transform_jobs[1]])
+        graph.notify_completed(transform_jobs[1].id)
+        self.assertEqual(pop_all(graph), [merge_job])
+
+    def test_failed(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        config = MockResource('config')
+        jobs = [
+            MockJob('config', [], [config]),
+            MockJob('use', [config], [MockResource('used')]),
+            MockJob('calc', [source], [MockResource('result')]),
+        ]
+        graph = create_graph(jobs)
+        self.assertEqual(pop_all(graph), [jobs[0]])
+
+        # Only jobs downstream of the failed job are blocked
+        graph.notify_failed(jobs[0].id)
+        self.assertEqual(pop_all(graph), [jobs[2]])
+        graph.notify_completed(jobs[2].id)
+        self.assertEqual(pop_all(graph), [])
+        self.assertFalse(graph.finished)
+
+    def test_inputs_changed(self):
+        resources, jobs = self.create_chain([1., None, None])
+        other_source = MockResource('other_source', createtime=1., is_temp=False)
+        other_job = MockJob('other', [other_source, resources[1]], [MockResource('other_result')])
+        graph = create_graph(jobs + [other_job])
+        while not graph.finished:
+            for job in pop_all(graph):
+                graph.notify_completed(job.id)
+        resources[1].exists = True
+
+        # Only jobs downstream of the changed input are queued again
+        graph.notify_inputs_changed([other_source])
+        self.assertEqual(pop_all(graph), [other_job])
+        graph.notify_completed(other_job.id)
+        self.assertTrue(graph.finished)
+
+        # Jobs recreating missing inputs of queued jobs are also queued
+        resources[1].exists = False
+        graph.notify_inputs_changed([other_source])
+        self.assertEqual(pop_all(graph), [jobs[0]])
+        graph.notify_completed(jobs[0].id)
+        self.assertEqual(set(pop_all(graph)), set([jobs[1], other_job]))
+
+    def test_namespaces(self):
+        source = MockResource('source', createtime=1., is_temp=False)
+        graph = create_graph([])
+
+        # Identical jobs in two namespaces are tracked separately
+        jobs = dict()
+        for namespace in ('sample1', 'sample2'):
+            jobs[namespace] = [
+                MockJob('config', [], [MockResource('config')]),
+                MockJob('calc', [source], [MockResource('result')]),
+            ]
+            graph.update(dict((job.id, job) for job in jobs[namespace]), namespace=namespace)
+
+        # A running job with no inputs only blocks its own namespace
+        config_jobs = pop_all(graph)
+        self.assertEqual([job.jobname for job in config_jobs], ['config', 'config'])
+        graph.notify_completed(jobs['sample1'][0].id, namespace='sample1')
+        self.assertEqual(pop_all(graph), [jobs['sample1'][1]])
+        graph.notify_completed(jobs['sample1'][1].id, namespace='sample1')
+
+        self.assertTrue(graph.is_finished('sample1'))
+        self.assertFalse(graph.is_finished('sample2'))
+        graph.notify_completed(jobs['sample2'][0].id, namespace='sample2')
+        self.assertEqual(pop_all(graph), [jobs['sample2'][1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,18 @@
 import unittest
+import collections
+import json
 import shutil
 import os
 import logging
+import pickle
+import tempfile
+import threading
 import time
 
 import pypeliner
+import pypeliner.database
 import pypeliner.execqueue.factory
+import pypeliner.graph
 import pypeliner.runskip
 import pypeliner.scheduler
 import pypeliner.workflow
@@ -13,17 +20,23 @@ import pypeliner.managed as mgd
 
 
 script_directory = os.path.dirname(os.path.abspath(__file__))
-pipeline_dir = os.path.join(script_directory, 'pipeline')
+output_directory = tempfile.mkdtemp(prefix='scheduler_test')
+pipeline_dir = os.path.join(output_directory, 'pipeline')
+logs_dir = os.path.join(pipeline_dir, 'log')
+
+
+def tearDownModule():
+    shutil.rmtree(output_directory, ignore_errors=True)
 
 
 class scheduler_test(unittest.TestCase):
 
     input_filename = os.path.join(script_directory, 'scheduler_test.input')
-    output_filename = os.path.join(script_directory, 'scheduler_test.output')
+    output_filename = os.path.join(output_directory, 'scheduler_test.output')
 
     input_n_filename = os.path.join(script_directory, 'scheduler_test.{byfile}.input')
-    output_n_filename = os.path.join(script_directory, 'scheduler_test.{byfile}.output')
-    output_n_template = os.path.join(script_directory, 'scheduler_test.{byfile}.template')
+    output_n_filename = os.path.join(output_directory, 'scheduler_test.{byfile}.output')
+    output_n_template = os.path.join(output_directory, 'scheduler_test.{byfile}.template')
 
     input_1_filename = input_n_filename.format(byfile=1)
     input_2_filename = input_n_filename.format(byfile=2)
@@ -31,7 +44,7 @@ class scheduler_test(unittest.TestCase):
     output_1_filename = output_n_filename.format(byfile=1)
     output_2_filename = output_n_filename.format(byfile=2)
 
-    log_filename = os.path.join(script_directory, './scheduler_test.log')
+    log_filename = os.path.join(output_directory, 'scheduler_test.log')
 
     try:
         os.remove(log_filename)
@@ -75,12 +88,17 @@ class scheduler_test(unittest.TestCase):
             except OSError:
                 pass
 
-    def run_workflow(self, workflow, cleanup=None, runskip=None):
+    def run_workflow(self, workflow, cleanup=None, runskip=None, flatten_subworkflows=False, targets=None,
+                     keep_going=False, max_jobs=10, max_temp_bytes=None):
 
         scheduler = pypeliner.scheduler.Scheduler()
         scheduler.workflow_dir = pipeline_dir
         scheduler.temps_dir = os.path.join(pipeline_dir, 'tmp')
-        scheduler.max_jobs = 10
+        scheduler.logs_dir = logs_dir
+        scheduler.max_jobs = max_jobs
+        scheduler.flatten_subworkflows = flatten_subworkflows
+        scheduler.keep_going = keep_going
+        scheduler.max_temp_bytes = max_temp_bytes
 
         if cleanup is not None:
             scheduler.cleanup = cleanup
@@ -92,7 +110,7 @@ class scheduler_test(unittest.TestCase):
             runskip = pypeliner.runskip.BasicRunSkip()
 
         with exec_queue, storage:
-            scheduler.run(workflow, exec_queue, storage, runskip)
+            scheduler.run(workflow, exec_queue, storage, runskip, targets=targets)
 
     def test_simple_chunks1(self):
 
@@ -276,6 +294,12 @@ class scheduler_test(unittest.TestCase):
             self.assertEqual(output, expected)
 
     def test_simple_sub_workflow(self):
+        self._run_simple_sub_workflow()
+
+    def test_flattened_sub_workflow(self):
+        self._run_simple_sub_workflow(flatten_subworkflows=True)
+
+    def _run_simple_sub_workflow(self, flatten_subworkflows=False):
 
         workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
 
@@ -305,7 +329,7 @@ class scheduler_test(unittest.TestCase):
                 mgd.TempInputFile('intermediate2', 'byfile'),
                 mgd.OutputFile(self.output_filename)))
 
-        self.run_workflow(workflow)
+        self.run_workflow(workflow, flatten_subworkflows=flatten_subworkflows)
 
         with open(self.output_filename, 'r') as output_file:
             output = output_file.readlines()
@@ -317,6 +341,146 @@ class scheduler_test(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    def test_targets(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='append_to_lines',
+            func='pypeliner.tests.tasks.append_to_lines',
+            args=(
+                mgd.InputFile(self.input_filename),
+                '#',
+                mgd.TempOutputFile('appended')))
+
+        workflow.transform(
+            name='copy_file',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.TempInputFile('appended'),
+                mgd.OutputFile(self.output_filename)))
+
+        workflow.transform(
+            name='copy_other_file',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.TempInputFile('appended'),
+                mgd.OutputFile(self.output_1_filename)))
+
+        # Record the files for which createtimes are retrieved
+        fetched = []
+        fetch_createtime = pypeliner.storage.RegularFile.fetch_createtime
+        def recording_fetch_createtime(store):
+            fetched.append(store.filename)
+            return fetch_createtime(store)
+        pypeliner.storage.RegularFile.fetch_createtime = recording_fetch_createtime
+        try:
+            self.run_workflow(workflow, targets=[self.output_filename])
+        finally:
+            pypeliner.storage.RegularFile.fetch_createtime = fetch_createtime
+
+        self.assertTrue(os.path.exists(self.output_filename))
+        self.assertFalse(os.path.exists(self.output_1_filename))
+        self.assertIn(self.output_filename, fetched)
+        self.assertNotIn(self.output_1_filename, fetched)
+
+        self.run_workflow(workflow, targets=['copy_other*'])
+
+        self.assertTrue(os.path.exists(self.output_1_filename))
+
+        # Targets that no job can match fail before the run
+        with self.assertRaises(ValueError):
+            self.run_workflow(workflow, targets=['typo_no_match'])
+
+    def test_split_targets(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='write_files',
+            func='pypeliner.tests.tasks.write_files',
+            args=(mgd.OutputFile(self.output_n_filename, 'byfile'),))
+
+        workflow.transform(
+            name='copy_files',
+            axes=('byfile',),
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.InputFile(self.output_n_filename, 'byfile'),
+                mgd.OutputFile(self.output_n_template, 'byfile')))
+
+        # Targets may match outputs on chunks defined during the run
+        self.run_workflow(workflow, targets=['write_files', self.output_n_template.format(byfile=1)])
+
+        self.assertTrue(os.path.exists(self.output_n_template.format(byfile=1)))
+        self.assertFalse(os.path.exists(self.output_n_template.format(byfile=2)))
+
+        # Targets matching no outputs once chunks are defined fail the run
+        with self.assertRaises(pypeliner.scheduler.PipelineException):
+            self.run_workflow(workflow, targets=['write_files', self.output_n_template.format(byfile=3)])
+
+    def test_keep_going(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='fail',
+            ctx={'num_retry': 0},
+            func='pypeliner.tests.tasks.do_assert',
+            args=(
+                mgd.InputFile(self.input_filename),
+                mgd.TempOutputFile('failed')))
+
+        workflow.transform(
+            name='copy_failed',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.TempInputFile('failed'),
+                mgd.OutputFile(self.output_1_filename)))
+
+        # Independent job finishing after the failure
+        workflow.transform(
+            name='delayed_copy_file',
+            func='pypeliner.tests.tasks.delayed_copy_file',
+            args=(
+                mgd.InputFile(self.input_filename),
+                mgd.TempOutputFile('copied'),
+                2))
+
+        workflow.transform(
+            name='copy_file',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.TempInputFile('copied'),
+                mgd.OutputFile(self.output_filename)))
+
+        self.assertRaises(pypeliner.scheduler.PipelineException, self.run_workflow, workflow, keep_going=True)
+
+        # Jobs independent of the failed job are run
+        self.assertTrue(os.path.exists(self.output_filename))
+        self.assertFalse(os.path.exists(self.output_1_filename))
+
+    def test_throttle(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        # Jobs fail if run concurrently
+        for idx in range(3):
+            workflow.transform(
+                name='copy_file_{}'.format(idx),
+                ctx={'throttle': {'lock': 1}, 'num_retry': 0},
+                func='pypeliner.tests.tasks.exclusive_copy_file',
+                args=(
+                    mgd.InputFile(self.input_filename),
+                    mgd.TempOutputFile('copied_{}'.format(idx)),
+                    os.path.join(pipeline_dir, 'lock')))
+
+        pypeliner.helpers.GlobalState.set('context_config', {'throttle': {'lock': 1}})
+        try:
+            self.run_workflow(workflow)
+        finally:
+            pypeliner.helpers.GlobalState.set('context_config', None)
+
     def test_specify_input_filename(self):
 
         workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
@@ -793,6 +957,540 @@ class scheduler_test(unittest.TestCase):
 
         self.assertEqual(output, ['line10\n', 'line21\n', 'line32\n', 'line43\n', 'line54\n', 'line65\n', 'line76\n', 'line87\n'])
 
+    def test_reduce_fanin(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        # Split input file by line and output one file per line
+        workflow.transform(
+            name='splitbyline',
+            func='pypeliner.tests.tasks.split_file_byline',
+            args=(
+                mgd.InputFile(self.input_filename),
+                1,
+                mgd.TempOutputFile('input_filename', 'byline')))
+
+        # Merge files through a tree of merges of at most 3 files
+        workflow.transform(
+            name='mergebyline',
+            func='pypeliner.tests.tasks.merge_file_byline',
+            args=(
+                mgd.TempInputFile('input_filename', 'byline'),
+                mgd.OutputFile(self.output_filename)),
+            reduce_fanin=3)
+
+        # Merge objects read from each file through a tree of merges of at most 2
+        workflow.transform(
+            name='read',
+            axes=('byline',),
+            func='pypeliner.tests.tasks.read_stuff',
+            ret=mgd.TempOutputObj('line', 'byline'),
+            args=(mgd.TempInputFile('input_filename', 'byline'),))
+
+        workflow.transform(
+            name='mergeobjs',
+            func='pypeliner.tests.tasks.merge_stuff',
+            ret=mgd.TempOutputObj('merged'),
+            args=(mgd.TempInputObj('line', 'byline').prop('some_string'),),
+            reduce_fanin=2)
+
+        workflow.transform(
+            name='write',
+            func='pypeliner.tests.tasks.write_stuff',
+            args=(
+                mgd.TempInputObj('merged'),
+                mgd.OutputFile(self.output_filename + '.objs'),))
+
+        self.run_workflow(workflow)
+
+        with open(self.input_filename, 'r') as input_file:
+            expected = input_file.read()
+
+        with open(self.output_filename, 'r') as output_file:
+            self.assertEqual(output_file.read(), expected)
+
+        with open(self.output_filename + '.objs', 'r') as output_file:
+            self.assertEqual(output_file.read(), expected.replace('\n', ''))
+
+        os.remove(self.output_filename + '.objs')
+
+    def test_incremental_merge(self):
+
+        input_n_filename = os.path.join(pipeline_dir, 'inputs', '{byfile}.input')
+        log_filename = os.path.join(pipeline_dir, 'merges.log')
+        pypeliner.helpers.makedirs(os.path.dirname(input_n_filename))
+
+        def write_input(chunk, text):
+            with open(input_n_filename.format(byfile=chunk), 'w') as input_file:
+                input_file.write(text + '\n')
+
+        def run_merge(chunks):
+            workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+            workflow.setobj(obj=mgd.OutputChunks('byfile'), value=chunks)
+
+            # Merge only the changed files into the previous merged file
+            workflow.transform(
+                name='merge',
+                func='pypeliner.tests.tasks.merge_file_byline_incremental',
+                args=(
+                    mgd.InputFile(input_n_filename, 'byfile'),
+                    mgd.OutputFile(self.output_filename),
+                    log_filename),
+                incremental=True)
+
+            self.run_workflow(workflow)
+
+            with open(self.output_filename, 'r') as output_file:
+                return output_file.read()
+
+        write_input('1', 'a')
+        write_input('2', 'b')
+        self.assertEqual(run_merge(['1', '2']), '1\ta\n2\tb\n')
+
+        write_input('2', 'c')
+        self.assertEqual(run_merge(['1', '2']), '1\ta\n2\tc\n')
+
+        write_input('3', 'd')
+        self.assertEqual(run_merge(['1', '3']), '1\ta\n3\td\n')
+
+        with open(log_filename, 'r') as log_file:
+            self.assertEqual(log_file.readlines(), ['1 2;\n', '2;\n', '3;2\n'])
+
+    def test_batch_size(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        # Split input file by line and output one file per line
+        workflow.transform(
+            name='splitbyline',
+            func='pypeliner.tests.tasks.split_file_byline',
+            args=(
+                mgd.InputFile(self.input_filename),
+                1,
+                mgd.TempOutputFile('input_filename', 'byline')))
+
+        # Write the process id of each job, in batches of 4 jobs
+        workflow.transform(
+            name='pid',
+            axes=('byline',),
+            ctx={'batch_size': 4},
+            func='pypeliner.tests.tasks.write_pid',
+            args=(
+                mgd.TempInputFile('input_filename', 'byline'),
+                mgd.TempOutputFile('pid_filename', 'byline')))
+
+        workflow.transform(
+            name='mergebyline',
+            func='pypeliner.tests.tasks.merge_file_byline',
+            args=(
+                mgd.TempInputFile('pid_filename', 'byline'),
+                mgd.OutputFile(self.output_filename)))
+
+        self.run_workflow(workflow)
+
+        with open(self.output_filename, 'r') as output_file:
+            pids = output_file.readlines()
+
+        self.assertEqual(len(pids), 8)
+        self.assertEqual(len(set(pids)), 2)
+
+    def test_pop_batch(self):
+
+        class MockJob(object):
+            is_streaming = False
+            workflow = None
+            def __init__(self, job_def):
+                self.job_def = job_def
+                self.ctx = {'batch_size': 4}
+
+        class MockWorkflow(object):
+            def __init__(self, jobs):
+                self.jobs = collections.deque(jobs)
+            def pop_next_job(self):
+                if len(self.jobs) == 0:
+                    raise pypeliner.graph.NoJobs()
+                return self.jobs.popleft()
+            def requeue_job(self, job):
+                self.jobs.appendleft(job)
+
+        jobs = [MockJob(job_def) for job_def in 'aabbbbbbaa']
+        workflow = MockWorkflow(jobs[1:])
+        for job in jobs:
+            job.workflow = workflow
+
+        scheduler = pypeliner.scheduler.Scheduler()
+        scheduler._init_run(None)
+
+        # Popping stops at a job of another definition, requeueing only that job
+        self.assertEqual(scheduler._pop_batch(workflow, jobs[0]), jobs[0:2])
+        self.assertEqual(list(workflow.jobs), jobs[2:])
+
+        self.assertEqual(scheduler._pop_batch(workflow, workflow.pop_next_job()), jobs[2:6])
+        self.assertEqual(scheduler._pop_batch(workflow, workflow.pop_next_job()), jobs[6:8])
+        self.assertEqual(list(workflow.jobs), jobs[8:])
+
+    def test_deferred_arguments(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='copy',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.InputFile(self.input_filename),
+                mgd.TempOutputFile('copied')))
+
+        workflow.transform(
+            name='write',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.TempInputFile('copied'),
+                mgd.OutputFile(self.output_filename)))
+
+        storage = pypeliner.storage.create('local', pipeline_dir)
+        with storage, pypeliner.database.WorkflowDatabaseFactory(
+                os.path.join(pipeline_dir, 'tmp'), pipeline_dir, os.path.join(pipeline_dir, 'log'), storage
+        ) as db_factory:
+            workflow_inst = pypeliner.graph.WorkflowInstance(workflow, db_factory, pypeliner.runskip.BasicRunSkip())
+            jobs = dict((job.jobname, job) for job in workflow_inst.graph.jobs.values())
+
+            # Arguments and store directories are created when jobs are used
+            for job in jobs.values():
+                self.assertIsNone(job._arglist)
+                self.assertIsNone(job.store_dir)
+            arglist = jobs['copy'].arglist
+            self.assertEqual(len(arglist), 2)
+            self.assertIsNotNone(jobs['copy'].store_dir)
+            self.assertIs(jobs['copy'].arglist, arglist)
+
+            # Jobs share the resources of the jobs creating their inputs
+            self.assertIs(jobs['write'].inputs[0], jobs['copy'].outputs[0])
+
+    def test_max_temp_bytes(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        log_filename = os.path.join(pipeline_dir, 'temps.log')
+
+        workflow.setobj(mgd.OutputChunks('byfile'), (1, 2))
+
+        # Produce a temporary copy of the input for each chunk
+        workflow.transform(
+            name='produce',
+            axes=('byfile',),
+            func='pypeliner.tests.tasks.log_copy_file',
+            args=(
+                mgd.InputFile(self.input_filename),
+                mgd.TempOutputFile('copy', 'byfile'),
+                log_filename,
+                'produce'))
+
+        # Consume each temporary copy, allowing it to be cleaned up
+        workflow.transform(
+            name='consume',
+            axes=('byfile',),
+            func='pypeliner.tests.tasks.log_copy_file',
+            args=(
+                mgd.TempInputFile('copy', 'byfile'),
+                mgd.OutputFile(self.output_n_filename, 'byfile'),
+                log_filename,
+                'consume'))
+
+        # A single temporary exceeds the budget, so each copy is consumed
+        # before the next is produced
+        self.run_workflow(workflow, max_jobs=1, max_temp_bytes=1)
+
+        with open(log_filename, 'r') as log_file:
+            self.assertEqual(log_file.read().split(), ['produce', 'consume', 'produce', 'consume'])
+
+        with open(self.input_filename, 'r') as input_file:
+            expected = input_file.read()
+
+        for chunk in (1, 2):
+            with open(self.output_n_filename.format(byfile=chunk), 'r') as output_file:
+                self.assertEqual(output_file.read(), expected)
+
+    def test_temp_bytes(self):
+
+        os.makedirs(pipeline_dir)
+        storage = pypeliner.storage.create('local', pipeline_dir)
+        with storage:
+            stores = [storage.create_store(os.path.join(pipeline_dir, 'temp{}'.format(idx)), is_temp=True)
+                      for idx in range(2)]
+            for size, store in zip((3, 5), stores):
+                with open(store.write_filename, 'w') as temp_file:
+                    temp_file.write('x' * size)
+                store.push()
+            self.assertEqual(storage.temp_bytes, 8)
+
+            stores[0].delete()
+            self.assertEqual(storage.temp_bytes, 5)
+
+        # The budget is rejected for storage not tracking temporary file sizes
+        scheduler = pypeliner.scheduler.Scheduler()
+        scheduler.max_temp_bytes = 1
+        scheduler._init_run(storage)
+        self.assertRaises(ValueError, scheduler._init_run, object())
+
+    def test_prefetch_createtimes(self):
+
+        storage = pypeliner.storage.create('local', pipeline_dir)
+
+        with storage:
+            stores = [
+                storage.create_store(self.input_filename),
+                storage.create_store(self.output_filename),
+                storage.create_store(os.path.join(pipeline_dir, 'temp'), is_temp=True)]
+
+            pypeliner.storage.prefetch_createtimes(stores)
+
+            for store in stores:
+                self.assertTrue(store.is_createtime_cached())
+
+            self.assertEqual(stores[0].get_createtime(), os.path.getmtime(self.input_filename))
+            self.assertFalse(stores[1].get_exists())
+            self.assertIsNone(stores[1].get_createtime())
+
+    def test_lazy_explanations(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='copy',
+            func='pypeliner.tests.tasks.copy_file',
+            args=(
+                mgd.InputFile(self.input_filename),
+                mgd.OutputFile(self.output_filename)))
+
+        explanations = []
+
+        class RecordingRunSkip(pypeliner.runskip.BasicRunSkip):
+            def __call__(self, job):
+                is_run_required, explanation = super(RecordingRunSkip, self).__call__(job)
+                explanations.append(explanation)
+                return is_run_required, explanation
+
+        # Explanations are not rendered above debug level
+        logger = logging.getLogger('pypeliner.workflowgraph')
+        logger.setLevel(logging.INFO)
+        try:
+            self.run_workflow(workflow, runskip=RecordingRunSkip())
+        finally:
+            logger.setLevel(logging.NOTSET)
+
+        self.assertEqual(len(explanations), 1)
+        self.assertIsNone(explanations[0]._text)
+        self.assertIn('output ' + self.output_filename, str(explanations[0]))
+
+    def test_json_formatter(self):
+
+        record = logging.LogRecord(
+            'pypeliner.workflowgraph', logging.INFO, __file__, 0,
+            'job %s run: %s', ('/copy', True), None)
+        fields = json.loads(pypeliner.helpers.JsonFormatter().format(record))
+
+        self.assertEqual(fields['msg'], 'job /copy run: True')
+        self.assertNotIn('args', fields)
+
+    def test_rewritten_axis_chunks(self):
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='splitbyline',
+            func='pypeliner.tests.tasks.split_file_byline',
+            args=(
+                mgd.InputFile(self.input_filename),
+                1,
+                mgd.TempOutputFile('input_filename', 'byline')))
+
+        workflow.transform(
+            name='mergebyline',
+            func='pypeliner.tests.tasks.merge_file_byline',
+            args=(
+                mgd.TempInputFile('input_filename', 'byline'),
+                mgd.OutputFile(self.output_filename)))
+
+        self.run_workflow(workflow, cleanup=False)
+
+        # Rewrite the chunks object with fewer chunks without changing its
+        # createtime, the rewritten chunks are read on restart
+        chunks_filename = os.path.join(pipeline_dir, 'tmp', 'byline._o')
+        createtime = os.path.getmtime(chunks_filename)
+        with open(chunks_filename, 'rb') as chunks_file:
+            chunks = pickle.load(chunks_file)
+        with open(chunks_filename, 'wb') as chunks_file:
+            pickle.dump(chunks[:2], chunks_file)
+        os.utime(chunks_filename, (createtime, createtime))
+
+        os.remove(self.output_filename)
+
+        self.run_workflow(workflow, cleanup=False)
+
+        with open(self.output_filename, 'r') as output_file:
+            self.assertEqual(output_file.readlines(), ['line1\n', 'line2\n'])
+
+    def _create_logged_copy_workflow(self):
+        """ Workflow copying the first of two inputs to the output through a
+        temporary, and the second to another output, logging the jobs run.
+        """
+        os.makedirs(pipeline_dir)
+        log_filename = os.path.join(pipeline_dir, 'copies.log')
+        input_filenames = [os.path.join(pipeline_dir, 'copies{}.input'.format(idx)) for idx in range(2)]
+        for input_filename in input_filenames:
+            shutil.copy(self.input_filename, input_filename)
+
+        workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
+
+        workflow.transform(
+            name='copy',
+            func='pypeliner.tests.tasks.log_copy_file',
+            args=(
+                mgd.InputFile(input_filenames[0]),
+                mgd.TempOutputFile('copied'),
+                log_filename,
+                'copy'))
+
+        workflow.transform(
+            name='write',
+            func='pypeliner.tests.tasks.log_copy_file',
+            args=(
+                mgd.TempInputFile('copied'),
+                mgd.OutputFile(self.output_filename),
+                log_filename,
+                'write'))
+
+        workflow.transform(
+            name='other',
+            func='pypeliner.tests.tasks.log_copy_file',
+            args=(
+                mgd.InputFile(input_filenames[1]),
+                mgd.OutputFile(self.output_filename + '.other'),
+                log_filename,
+                'other'))
+
+        return workflow, input_filenames, log_filename
+
+    def test_watch(self):
+
+        workflow, input_filenames, log_filename = self._create_logged_copy_workflow()
+
+        scheduler = pypeliner.scheduler.Scheduler()
+        scheduler.workflow_dir = pipeline_dir
+        scheduler.temps_dir = os.path.join(pipeline_dir, 'tmp')
+        scheduler.logs_dir = logs_dir
+        scheduler.max_jobs = 10
+        scheduler.watch_poll_period = 0.1
+
+        def watch():
+            exec_queue = pypeliner.execqueue.factory.create('local', [])
+            storage = pypeliner.storage.create('local', pipeline_dir)
+            with exec_queue, storage:
+                scheduler.watch(workflow, exec_queue, storage, pypeliner.runskip.BasicRunSkip(), max_reruns=1)
+
+        watch_thread = threading.Thread(target=watch)
+        watch_thread.start()
+
+        def read_log():
+            try:
+                with open(log_filename, 'r') as log_file:
+                    return sorted(log_file.read().split())
+            except IOError:
+                return []
+
+        for _ in range(600):
+            if read_log() == ['copy', 'other', 'write']:
+                break
+            time.sleep(0.1)
+
+        # Modify the first input, only its downstream jobs are rerun
+        with open(input_filenames[0], 'w') as input_file:
+            input_file.write('modified\n')
+        modified_time = time.time() + 10
+        os.utime(input_filenames[0], (modified_time, modified_time))
+
+        watch_thread.join(60)
+        self.assertFalse(watch_thread.is_alive())
+
+        self.assertEqual(read_log(), ['copy', 'copy', 'other', 'write', 'write'])
+        with open(self.output_filename, 'r') as output_file:
+            self.assertEqual(output_file.read(), 'modified\n')
+
+        os.remove(self.output_filename + '.other')
+
+    def test_plan(self):
+
+        workflow, input_filenames, log_filename = self._create_logged_copy_workflow()
+
+        self.run_workflow(workflow, cleanup=False)
+
+        # Modify the first input, the write job runs as its input would be recreated
+        # and the other job is skipped
+        modified_time = time.time() + 10
+        os.utime(input_filenames[0], (modified_time, modified_time))
+
+        scheduler = pypeliner.scheduler.Scheduler()
+        scheduler.workflow_dir = pipeline_dir
+        scheduler.temps_dir = os.path.join(pipeline_dir, 'tmp')
+        scheduler.logs_dir = logs_dir
+        scheduler.max_jobs = 10
+
+        def snapshot():
+            files = dict()
+            for root, dirs, filenames in os.walk(pipeline_dir):
+                for name in dirs + filenames:
+                    path = os.path.join(root, name)
+                    files[path] = os.path.isfile(path) and (os.path.getmtime(path), open(path, 'rb').read())
+            return files
+
+        before = snapshot()
+
+        storage = pypeliner.storage.create('local', pipeline_dir, in_memory=True)
+        with storage:
+            plan = scheduler.plan(workflow, storage, pypeliner.runskip.BasicRunSkip())
+
+        # The pipeline directory is untouched
+        self.assertEqual(snapshot(), before)
+
+        self.assertEqual([job['name'] for job in plan['jobs']], ['/copy', '/write'])
+        self.assertIn('out of date', plan['jobs'][0]['explanation'])
+        self.assertIn('inputs recreated by upstream jobs', plan['jobs'][1]['explanation'])
+        for job in plan['jobs']:
+            self.assertTrue(job['duration_recorded'])
+            self.assertEqual(job['ctx']['mem'], 1)
+        self.assertEqual(plan['num_jobs'], 2)
+        self.assertAlmostEqual(plan['cpu_hours'], sum(job['duration'] for job in plan['jobs']) / 3600.)
+        self.assertAlmostEqual(plan['wall_hours'], plan['cpu_hours'])
+
+        # No jobs were run
+        with open(log_filename, 'r') as log_file:
+            self.assertEqual(sorted(log_file.read().split()), ['copy', 'other', 'write'])
+        os.remove(self.output_filename + '.other')
+
+    def test_plan_runskip(self):
+
+        class MockResource(object):
+            def __init__(self, filename):
+                self.filename = filename
+
+        class MockJob(object):
+            runskip_request = None
+            def __init__(self, name, inputs, outputs):
+                self.displayname = name
+                self.input_resources = inputs
+                self.output_resources = outputs
+            def explain_out_of_date(self, reason):
+                return reason
+
+        runskip = pypeliner.runskip.PlanRunSkip(lambda job: (job.displayname == 'run', 'out of date'))
+
+        # Outputs without filenames are not recreated inputs of other jobs
+        self.assertTrue(runskip(MockJob('run', [], [MockResource(None), MockResource('a')]))[0])
+        self.assertFalse(runskip(MockJob('unnamed', [MockResource(None)], []))[0])
+        self.assertEqual(runskip(MockJob('named', [MockResource('a')], [])),
+                         (True, 'inputs recreated by upstream jobs'))
+
     def test_split_getinstances(self):
 
         workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
@@ -1000,6 +1698,43 @@ class scheduler_test(unittest.TestCase):
                 tmp_input_data = tmp_input_data_file.readlines()
                 self.assertEqual(tmp_input_data, tmp_data_check)
 
+    def test_streaming_split(self):
+
+        workflow = pypeliner.workflow.Workflow(default_ctx=self.ctx)
+
+        # Split waits for the first chunk to be processed before continuing
+        workflow.transform(
+            name='split_byline',
+            func='pypeliner.tests.tasks.split_file_byline_streaming',
+            args=(
+                mgd.InputFile(self.input_filename),
+                2,
+                mgd.TempOutputFile('input_data', 'byline', streaming=True),
+                os.path.join(pipeline_dir, 'tmp/byline/0/output_data')))
+
+        workflow.transform(
+            name='do',
+            axes=('byline',),
+            func='pypeliner.tests.tasks.do_file_stuff',
+            args=(
+                mgd.TempInputFile('input_data', 'byline'),
+                mgd.TempOutputFile('output_data', 'byline'),
+                mgd.InputInstance('byline')))
+
+        workflow.transform(
+            name='merge_byline',
+            func='pypeliner.tests.tasks.merge_file_byline',
+            args=(
+                mgd.TempInputFile('output_data', 'byline'),
+                mgd.OutputFile(self.output_filename)))
+
+        self.run_workflow(workflow, cleanup=False)
+
+        with open(self.output_filename, 'r') as output_file:
+            output = output_file.readlines()
+
+        self.assertEqual(output, ['00line1\n', '10line2\n', '01line3\n', '11line4\n', '02line5\n', '12line6\n', '03line7\n', '13line8\n'])
+
     def test_rerun_simple(self):
 
         workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
@@ -1341,14 +2076,15 @@ class scheduler_test(unittest.TestCase):
 
         workflow = pypeliner.workflow.Workflow(ctx=self.ctx)
 
-        shutil.copyfile(self.input_filename, self.input_filename+'.tmp')
+        input_filename = os.path.join(output_directory, 'scheduler_test.input.tmp')
+        shutil.copyfile(self.input_filename, input_filename)
 
         # Read the same data into a managed object
         workflow.transform(
             name='read',
             func='pypeliner.tests.tasks.read_stuff',
             ret=mgd.TempOutputObj('input_data'),
-            args=(mgd.InputFile(self.input_filename+'.tmp'),))
+            args=(mgd.InputFile(input_filename),))
 
         # Extract a property of the managed object, modify it
         # and store the result in another managed object
@@ -118,7 +118,8 @@ class Workflow(object):
             args=args, kwargs=kwargs, sandbox=None
         )
 
-    def transform(self, name='', axes=(), ctx=None, func=None, ret=None, args=None, kwargs=None, sandbox=None):
+    def transform(self, name='', axes=(), ctx=None, func=None, ret=None, args=None, kwargs=None, sandbox=None,
+                  reduce_fanin=None, incremental=False):
         """ Add a transform to the pipeline.  A transform defines a job that uses the
         provided python function ``func`` to take input dependencies and create/update
         output dependents.
@@ -133,11 +134,27 @@ class Workflow(object):
                     is given to the exec queue and provides a way of communicating jobs
                     specific requirements such as memory and cpu usage.  Setting
                     ``ctx['local'] = True`` will result in the job being run locally on
-                    the calling machine even when a cluster is being used.
+                    the calling machine even when a cluster is being used.  Jobs with
+                    a higher ``ctx['priority']`` are submitted before other ready jobs.
+                    ``ctx['throttle']`` maps throttle names to the amount used by the
+                    job, limited by the throttles of the ``context_config`` option.
+                    With ``ctx['batch_size']`` set, up to that many ready instances
+                    of the job are submitted as a single job and run in sequence.
         :param func: The function to call for this job.
         :param ret: The return value
         :param args: The list of positional arguments to be used for the function call.
         :param kwargs: The list of keyword arguments to be used for the function call.
+        :param reduce_fanin: For a job merging a single input along one axis into a
+                             single output of the same kind, merge at most this many
+                             inputs per job, adding levels of intermediate merges run
+                             in parallel.  The merge must be associative, and is given
+                             the indices of intermediate merges as keys, ordered as
+                             the chunks they merge.
+        :param incremental: For a job merging a single input along one axis into a
+                            single output, the merge input resolves to a
+                            :py:class:`pypeliner.arguments.IncrementalMerge` with the
+                            previous result, and only the chunks added or changed
+                            and the chunks removed since the previous merge.
 
         Any value in args or kwargs that is an instance of
         :py:class:`pypeliner.managed.Managed` will be resolved to a pipeline managed
@@ -160,9 +177,17 @@ class Workflow(object):
         job_ctx['no_container'] = False
         if sandbox is None:
             sandbox = self.default_sandbox
-        self.job_definitions[name] = pypeliner.jobs.JobDefinition(
-            name, axes, job_ctx, func, pypeliner.jobs.CallSet(ret=ret, args=args, kwargs=kwargs), sandbox=sandbox
-        )
+        argset = pypeliner.jobs.CallSet(ret=ret, args=args, kwargs=kwargs)
+        if reduce_fanin is not None and incremental:
+            raise ValueError('job {} cannot be both a reduce and an incremental merge'.format(name))
+        if incremental:
+            job_def = pypeliner.jobs.IncrementalJobDefinition(name, axes, job_ctx, func, argset, sandbox=sandbox)
+        elif reduce_fanin is not None:
+            job_def = pypeliner.jobs.ReduceJobDefinition(
+                name, axes, job_ctx, func, argset, sandbox=sandbox, fanin=reduce_fanin)
+        else:
+            job_def = pypeliner.jobs.JobDefinition(name, axes, job_ctx, func, argset, sandbox=sandbox)
+        self.job_definitions[name] = job_def
 
     def subworkflow(self, name='', axes=(), ctx=None, func=None, args=None, kwargs=None):
         """ Add a sub workflow to the pipeline.  A sub workflow is a set of jobs that
@@ -179,7 +204,10 @@ class Workflow(object):
                     is given to the exec queue and provides a way of communicating jobs
                     specific requirements such as memory and cpu usage.  Setting
                     ``ctx['local'] = True`` will result in the job being run locally on
-                    the calling machine even when a cluster is being used.
+                    the calling machine even when a cluster is being used.  Jobs with
+                    a higher ``ctx['priority']`` are submitted before other ready jobs.
+                    ``ctx['throttle']`` maps throttle names to the amount used by the
+                    job, limited by the throttles of the ``context_config`` option.
         :param func: The function to call for this job.
         :param args: The list of positional arguments to be used for the function call.
         :param kwargs: The list of keyword arguments to be used for the function call.
@@ -203,14 +231,27 @@ class Workflow(object):
             name, axes, job_ctx, func, pypeliner.jobs.CallSet(ret=ret, args=args, kwargs=kwargs)
         )
 
-    def _create_job_instances(self, graph, db):
+    def _get_job_definitions(self, axes=None):
+        """ Get job definitions, restricted to those defined on or referencing
+        any of the given axes if axes are specified.
+        """
+        if axes is None:
+            return list(self.job_definitions.values())
+        axes = set(axes)
+        return [job_def for job_def in self.job_definitions.values()
+                if not axes.isdisjoint(job_def.all_axes)]
+
+    def _create_job_instances(self, graph, db, job_defs=None, nodes=None):
         """ Create job instances from job definitions given resource and node managers,
-        and a log directory.
+        and a log directory, restricted to the given nodes if specified.
         """
-        for job_def in self.job_definitions.values():
+        if job_defs is None:
+            job_defs = list(self.job_definitions.values())
+
+        for job_def in job_defs:
             if hasattr(job_def, 'sandbox') and job_def.sandbox is not None:
                 job_def.sandbox.create_conda_env(db.envs_dir)
 
-        for job_def in self.job_definitions.values():
-            for job_inst in job_def.create_job_instances(graph, db):
+        for job_def in job_defs:
+            for job_inst in job_def.create_job_instances(graph, db, nodes=nodes):
                 yield job_inst
@@ -20,8 +20,10 @@ setup(
     },
     install_requires=[
         'dill',
-        'networkx',
         'pyyaml',
         'six',
     ],
+    extras_require={
+        'debug': ['networkx'],
+    },
 )